@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+
+class Amount:
+    # EUR amount, stored as integer cents
+    __slots__ = ('_cents',)
+
+    _separators = str.maketrans('', '', '.,')
+
+    def __init__(self, amount):
+        # Input as int means expects full EUR only, no cents.
+        if type(amount) is int:
+            self._cents = amount * 100
+        # Input as str expects EUR and cents, e.g. 23,00 or 23.50 or 1.234,56
+        elif type(amount) is str:
+            amount = amount.strip()
+            assert len(amount) >= 3 and amount[-3] in ',.'
+            self._cents = int(amount.translate(Amount._separators))
+        elif isinstance(amount, Amount):
+            self._cents = amount._cents
+        else:
+            assert False
+
+    @staticmethod
+    def fromCents(cents):
+        amount = Amount.__new__(Amount)
+        amount._cents = cents
+        return amount
+
+    @property
+    def cents(self):
+        return self._cents
+
+    def get(self, decimalSeparator=','):
+        # Return amount string
+        assert decimalSeparator in [ ',', '.' ]
+        euros, cents = divmod(abs(self._cents), 100)
+        return ('-' if self._cents < 0 else '') + str(euros) + decimalSeparator + ('0' if cents < 10 else '') + str(cents)
+
+    def share(self, percent):
+        # Return 'percent' % of this amount, rounded down to full cents
+        return Amount.fromCents(int(self._cents * percent // 100))
+
+    def canCoverTransactionAmount(self, amount):
+        if not isinstance(amount, Amount):
+            amount = Amount(amount)
+        return self._cents > amount._cents
+
+    def __add__(self, other):
+        if not isinstance(other, Amount):
+            return NotImplemented
+        return Amount.fromCents(self._cents + other._cents)
+
+    def __sub__(self, other):
+        if not isinstance(other, Amount):
+            return NotImplemented
+        return Amount.fromCents(self._cents - other._cents)
+
+    def __neg__(self):
+        return Amount.fromCents(-self._cents)
+
+    # Operands other than 'Amount' are not supported (TypeError, unequal)
+    def __eq__(self, other):
+        if not isinstance(other, Amount):
+            return NotImplemented
+        return self._cents == other._cents
+
+    def __ne__(self, other):
+        if not isinstance(other, Amount):
+            return NotImplemented
+        return self._cents != other._cents
+
+    def __lt__(self, other):
+        if not isinstance(other, Amount):
+            return NotImplemented
+        return self._cents < other._cents
+
+    def __le__(self, other):
+        if not isinstance(other, Amount):
+            return NotImplemented
+        return self._cents <= other._cents
+
+    def __gt__(self, other):
+        if not isinstance(other, Amount):
+            return NotImplemented
+        return self._cents > other._cents
+
+    def __ge__(self, other):
+        if not isinstance(other, Amount):
+            return NotImplemented
+        return self._cents >= other._cents
+
+    def __hash__(self):
+        return hash(self._cents)
+
+    def __str__(self):
+        return self.get()
+
+    def __repr__(self):
+        return "Amount('" + self.get() + "')"
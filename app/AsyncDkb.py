@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+import asyncio
+import logging
+import threading
+
+import config
+from Dkb import Dkb
+from DkbMetrics import DkbMetrics
+from DkbParser import WebsiteNotLoadable
+
+class AsyncDkb:
+    # Asyncio variant of the 'Dkb' API. Remittances of different source accounts overlap their network waits:
+    # every source account is bound to one of up to c['ASYNC_SESSIONS'] sessions ('Dkb' objects with their own
+    # login), whose blocking requests run in worker threads. A session prepares one transaction at a time, from
+    # 'remittance' until 'approveCurrentTransaction' or 'abortCurrentTransaction' of its source account, so the
+    # remittances of one source account (and their balance checks) keep their call order.
+    # Routing, balance checks and review are the ones of 'Dkb'. A transfer between own accounts is booked on the
+    # snapshot of the session of its source account. The session of the credited account refetches its snapshot,
+    # if its balance appears to be insufficient, like 'Dkb' does for incoming transactions.
+
+    def __init__(self, metrics=None, sessions=None):
+        # metrics: 'DkbMetrics' instance shared by all sessions, by default created as configured by c['METRICS_SINK']
+        self._logger = logging.getLogger(self.__class__.__name__)
+        self._closeMetrics = metrics is None
+        self._metrics = metrics if metrics is not None else DkbMetrics.create()
+        self._sink = _LockedSink(self._metrics.sink) if self._metrics else None
+        self._maxSessions = sessions if sessions else config.c['ASYNC_SESSIONS']
+        self._sessions = []
+        # Session of every source account used so far
+        self._sessionOf = {}
+        self._credentials = None
+
+    async def login(self, userid, pin):
+        # Login of the first session. Further sessions log in, when their first source account is used.
+        self._credentials = (userid, pin)
+        session = self._newSession()
+        session.loggedIn = await asyncio.to_thread(session.dkb.login, userid, pin)
+        return session.loggedIn
+
+    async def logout(self):
+        try:
+            await asyncio.gather(*[ asyncio.to_thread(session.dkb.logout) for session in self._sessions if session.loggedIn ])
+        finally:
+            if self._metrics and self._closeMetrics:
+                self._metrics.close()
+
+    def getAccounts(self):
+        return self._sessions[0].dkb.getAccounts()
+
+    def getBalance(self, account):
+        return self._sessions[0].dkb.getBalance(account)
+
+    def transactionType(self, source, target):
+        return Dkb.route(self.getAccounts(), source, target)
+
+    async def remittance(self, source, target, amount, creditorName=None, purpose=None):
+        # Prepare a transaction like 'Dkb.remittance', waits while the session of 'source' is busy. The session
+        # is held until 'approveCurrentTransaction' or 'abortCurrentTransaction' of 'source'.
+        session = self._session(source)
+        await session.lock.acquire()
+        try:
+            if not session.loggedIn:
+                session.loggedIn = await asyncio.to_thread(session.dkb.login, *self._credentials)
+                if not session.loggedIn:
+                    raise WebsiteNotLoadable("Login of session " + str(session.index) + " failed.")
+            return await asyncio.to_thread(session.dkb.remittance, source, target, amount, creditorName, purpose)
+        except BaseException:
+            session.lock.release()
+            raise
+
+    async def approveCurrentTransaction(self, source, target, amount, tan=None):
+        session = self._sessionOf[source]
+        assert session.lock.locked()
+        try:
+            return await asyncio.to_thread(session.dkb.approveCurrentTransaction, source, target, amount, tan)
+        finally:
+            session.lock.release()
+
+    def abortCurrentTransaction(self, source):
+        # Release the session of 'source' without committing the prepared transaction
+        session = self._sessionOf[source]
+        assert session.lock.locked()
+        session.lock.release()
+
+    def _session(self, source):
+        session = self._sessionOf.get(source)
+        if session is None:
+            # An idle session first, then a new one, then the sessions in turn
+            used = set(id(s) for s in self._sessionOf.values())
+            idle = [ s for s in self._sessions if id(s) not in used ]
+            if idle:
+                session = idle[0]
+            elif len(self._sessions) < self._maxSessions:
+                session = self._newSession()
+            else:
+                session = self._sessions[len(self._sessionOf) % len(self._sessions)]
+            self._sessionOf[source] = session
+            self._logger.info("Source account '" + source + "' served by session " + str(session.index) + ".")
+        return session
+
+    def _newSession(self):
+        index = len(self._sessions)
+        # One session file per session, the first one is the regular one
+        sessionStore = config.c['SESSION_STORE']
+        if sessionStore and index > 0:
+            sessionStore += '.' + str(index)
+        metrics = DkbMetrics(self._sink) if self._sink else None
+        session = _Session(index, Dkb(metrics, sessionStore))
+        self._sessions.append(session)
+        return session
+
+
+class _Session:
+    __slots__ = ('index', 'dkb', 'lock', 'loggedIn')
+
+    def __init__(self, index, dkb):
+        self.index = index
+        self.dkb = dkb
+        self.lock = asyncio.Lock()
+        self.loggedIn = False
+
+
+class _LockedSink:
+    # Metrics sink shared by the sessions, records arrive from several worker threads
+    def __init__(self, sink):
+        self._sink = sink
+        self._lock = threading.Lock()
+
+    def add(self, record):
+        with self._lock:
+            self._sink.add(record)
+
+    def close(self):
+        self._sink.close()
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+import hashlib
+import logging
+import multiprocessing
+import queue
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import config
+from Job import Job
+from Dkb import Dkb, BalanceNotSufficient, TransactionFailed, WebsiteNotLoadable
+
+class BatchRunner:
+    # Runs the dispatch jobs of several tenants (independent logins) in parallel worker processes.
+    # Every tenant gets its own 'Dkb' session. Commit decisions (and TANs) are requested from the
+    # main process, so the operator interaction stays in one place while the sessions proceed.
+    POLL_INTERVAL = 0.05
+
+    def __init__(self, workers):
+        self._logger = logging.getLogger(self.__class__.__name__)
+        self._workers = workers
+
+    def run(self, tenants, decide):
+        # tenants: list of { 'name', 'userid', 'pin', 'jobs' } with calculated 'ShareValue' of all jobs
+        # decide(tenantName, transaction): returns (commit, tan), raises KeyboardInterrupt (or any error) to abort all
+        # Returns the tenant results in the order of 'tenants' and the wall time.
+        settings = { 'config': dict(config.c), 'baseurl': Dkb.BASEURL, 'loglevel': logging.getLogger().level }
+        start = time.perf_counter()
+        with multiprocessing.Manager() as manager, ProcessPoolExecutor(max_workers=max(1, min(self._workers, len(tenants)))) as pool:
+            requests = manager.Queue()
+            replies = { tenant['name']: manager.Queue() for tenant in tenants }
+            futures = [ pool.submit(runTenant, tenant, settings, requests, replies[tenant['name']]) for tenant in tenants ]
+            aborted = False
+            pending = set(futures)
+            while pending:
+                try:
+                    name, transaction = requests.get(timeout=BatchRunner.POLL_INTERVAL)
+                except queue.Empty:
+                    pending = { f for f in pending if not f.done() }
+                    continue
+                decision = None
+                if not aborted:
+                    try:
+                        decision = decide(name, transaction)
+                    except KeyboardInterrupt:
+                        self._logger.info("Remaining transactions of all tenants aborted...")
+                        aborted = True
+                    except Exception as e:
+                        # Workers wait for a reply - keep answering, otherwise the pool never shuts down
+                        self._logger.error("ERROR: No decision for tenant '" + name + "' (" + repr(e) + "), remaining transactions of all tenants aborted.")
+                        aborted = True
+                replies[name].put(decision)
+            results = [ f.result() for f in futures ]
+        return results, time.perf_counter() - start
+
+
+def runTenant(tenant, settings, requests, replies):
+    # Worker process: login, remit all jobs of the tenant, logout. Never raises, errors are reported in the result.
+    config.c.update(settings['config'])
+    Dkb.BASEURL = settings['baseurl']
+    config.setupLogging(settings['loglevel'])
+    if config.c['SESSION_STORE']:
+        # One session file per tenant: tenants of the same login run at the same time in their own sessions
+        config.c['SESSION_STORE'] += '.' + tenant['userid'] + '.' + hashlib.sha256(tenant['name'].encode('utf-8')).hexdigest()[:12]
+    logger = logging.getLogger('BatchRunner.' + tenant['name'])
+    result = { 'name': tenant['name'], 'jobs': [], 'error': None, 'login': 0.0, 'remit': 0.0, 'wait': 0.0, 'total': 0.0 }
+    start = time.perf_counter()
+    dkb = None
+    try:
+        dkb = Dkb()
+        if not dkb.login(tenant['userid'], tenant['pin']):
+            result['error'] = "Login failed."
+            dkb.logout()
+            return result
+        result['login'] = time.perf_counter() - start
+        for i, job in enumerate(tenant['jobs']):
+            creditor, description = Job.remittanceDetails(job)
+            try:
+                transaction = dkb.remittance(job[Job.JOB_SOURCEACCOUNT], job[Job.JOB_TARGETACCOUNT], job[Job.JOB_SHAREVALUE], creditor, description)
+            except (BalanceNotSufficient, WebsiteNotLoadable) as e:
+                result['jobs'].append((job[Job.JOB_NAME], job[Job.JOB_SHAREVALUE].get(), "failed: " + str(e)))
+                continue
+            # The operator reviewed the job - the prepared transaction has to match it
+            error = Job.checkTransaction(job, transaction)
+            if error:
+                result['jobs'].append((job[Job.JOB_NAME], job[Job.JOB_SHAREVALUE].get(), "failed: " + error))
+                continue
+            waitStart = time.perf_counter()
+            requests.put((tenant['name'], dict(transaction, name=job[Job.JOB_NAME])))
+            decision = replies.get()
+            result['wait'] += time.perf_counter() - waitStart
+            if decision is None:
+                logger.info("Remaining transactions aborted...")
+                for j in tenant['jobs'][i:]:
+                    result['jobs'].append((j[Job.JOB_NAME], j[Job.JOB_SHAREVALUE].get(), "aborted"))
+                break
+            commit, tan = decision
+            if not commit:
+                result['jobs'].append((job[Job.JOB_NAME], job[Job.JOB_SHAREVALUE].get(), "aborted"))
+                continue
+            try:
+                dkb.approveCurrentTransaction(transaction['source'], transaction['target'], transaction['amount'], tan)
+                result['jobs'].append((job[Job.JOB_NAME], job[Job.JOB_SHAREVALUE].get(), "done"))
+            except TransactionFailed as e:
+                result['jobs'].append((job[Job.JOB_NAME], job[Job.JOB_SHAREVALUE].get(), "failed: " + str(e)))
+        dkb.logout()
+    except Exception as e:
+        logger.error("ERROR: Tenant '" + tenant['name'] + "' stopped: " + repr(e))
+        result['error'] = repr(e)
+        if dkb:
+            try:
+                # Finish the metrics, the session may be unusable
+                dkb.logout()
+            except Exception:
+                pass
+    finally:
+        result['total'] = time.perf_counter() - start
+        result['remit'] = result['total'] - result['login'] - result['wait']
+    return result
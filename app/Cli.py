@@ -0,0 +1,18 @@
+#!/usr/bin/env python3
+from Job import Job
+
+# Terminal inquiries shared by the entry points 'dispatchIncome' and 'dispatchBatch'
+
+def inquireIncome(name=None):
+    # Inquire the shared income (of tenant 'name'), rounded down to a multiple of Job.INCOME_MULTIPLE_OF.
+    # Returns None, if aborted.
+    prompt = "Shared income" + (" of '" + name + "'" if name else "") + " (multiple of " + str(Job.INCOME_MULTIPLE_OF) + "): "
+    while True:
+        try:
+            income = Job.normalizeIncome(int(input(prompt)))
+            if income:
+                return income
+        except KeyboardInterrupt:
+            return None
+        except:
+            continue
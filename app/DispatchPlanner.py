@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+import logging
+from collections import deque
+
+from Job import Job
+from Dkb import Dkb
+
+class DispatchPlanner:
+    # Offline planning of a dispatch run on one account snapshot, before any transaction is initiated.
+    # Every job is routed like 'Dkb.remittance' does, unsupported jobs are rejected. Balances are
+    # simulated through the plan: a job, which its source account can not cover yet, is deferred until
+    # a transfer to this account funds it, or rejected at the end.
+    # Several job orders are simulated, the one covering the most jobs wins (on ties the earlier one):
+    #   1. file order
+    #   2. smallest amount first (maximizes the number of covered jobs per account)
+    #   3. transfers between own accounts first (file order), then smallest amount first
+    REASON_UNSUPPORTED = "Transaction type not supported."
+    REASON_NOT_COVERED = "Balance not sufficient."
+
+    def __init__(self, accounts):
+        # accounts: account snapshot { number: DkbAccount }
+        self._logger = logging.getLogger(self.__class__.__name__)
+        self._accounts = accounts
+
+    def plan(self, jobs, simulate=True):
+        # Returns the executable jobs in execution order as (job, transactionType) and the rejected jobs as (job, reason).
+        # Without 'simulate', jobs are only routed and kept in file order.
+        routed = []
+        rejected = []
+        for job in jobs:
+            transactionType = Dkb.route(self._accounts, job[Job.JOB_SOURCEACCOUNT], job[Job.JOB_TARGETACCOUNT])
+            if transactionType is None:
+                rejected.append((job, DispatchPlanner.REASON_UNSUPPORTED))
+            else:
+                routed.append((job, transactionType))
+        if not simulate:
+            return routed, rejected
+        byAmount = sorted(routed, key=lambda r: r[0][Job.JOB_SHAREVALUE].cents)
+        internal = [ r for r in routed if r[0][Job.JOB_TARGETACCOUNT] in self._accounts ]
+        orders = [
+            routed,
+            byAmount,
+            internal + [ r for r in byAmount if r[0][Job.JOB_TARGETACCOUNT] not in self._accounts ]
+        ]
+        best = None
+        for order in orders:
+            executed, deferred = self._simulate(order)
+            if best is None or len(executed) > len(best[0]):
+                best = (executed, deferred)
+            if not deferred:
+                break
+        executed, deferred = best
+        rejected += [ (job, DispatchPlanner.REASON_NOT_COVERED) for job, transactionType in deferred ]
+        if len(executed) != len(routed) or any(a[0] is not b[0] for a, b in zip(executed, routed)):
+            self._logger.info("Jobs reordered or deferred: " + str(len(executed)) + " of " + str(len(routed)) + " routed jobs covered by the balances.")
+        return executed, rejected
+
+    def _simulate(self, order):
+        # Simulate 'order' on the balances (cents), with the check of 'Amount.canCoverTransactionAmount'
+        balances = { number: account.balance.cents for number, account in self._accounts.items() }
+        waiting = {}
+        executed = []
+        queue = deque(order)
+        while queue:
+            job, transactionType = queue.popleft()
+            source = job[Job.JOB_SOURCEACCOUNT]
+            target = job[Job.JOB_TARGETACCOUNT]
+            amount = job[Job.JOB_SHAREVALUE].cents
+            if balances[source] <= amount:
+                waiting.setdefault(source, []).append((job, transactionType))
+                continue
+            balances[source] -= amount
+            executed.append((job, transactionType))
+            if target in balances:
+                balances[target] += amount
+                # Deferred jobs of the funded account are retried next
+                if target in waiting:
+                    queue.extendleft(reversed(waiting.pop(target)))
+        deferred = [ r for jobs in waiting.values() for r in jobs ]
+        # Keep the order of 'order' for the rejected jobs
+        position = { id(r[0]): i for i, r in enumerate(order) }
+        deferred.sort(key=lambda r: position[id(r[0])])
+        return executed, deferred
@@ -1,17 +1,42 @@
 #!/usr/bin/env python3
+import contextlib
+import datetime
 import logging
 import re
-from robobrowser import RoboBrowser
+import time
+from urllib.parse import urljoin, urlsplit
 
 import config
+from Amount import Amount
+from DkbEngine import RoboBrowserEngine, HttpEngine
+from DkbMetrics import DkbMetrics, InstrumentedEngine
+from DkbParser import DkbParser, DkbAccount, WebsiteNotLoadable
+
+# Step context, if instrumentation is disabled
+_NO_METRICS = contextlib.nullcontext()
 
 class Dkb:
     BASEURL = 'https://www.dkb.de'
     SERVICE_LOGIN = '/-'
     SERVICE_FINANCIAL_STATUS = '/DkbTransactionBanking/content/banking/financialstatus/FinancialComposite/FinancialStatus.xhtml'
+    SERVICE_TRANSACTIONS = '/banking/finanzstatus/kontoumsaetze'
+    # Encoding of the CSV export
+    CSV_ENCODING = 'iso-8859-1'
 
     ACCTYPE_CHECKING = 'CHECKING'
     ACCTYPE_CREDITCARD = 'CREDITCARD'
+    # Account type labels on the financial status page
+    ACCOUNT_TYPES = {
+        'Girokonto': ACCTYPE_CHECKING,
+        'Kreditkarte': ACCTYPE_CREDITCARD,
+        'DKB-VISA-Tagesgeld': ACCTYPE_CREDITCARD
+    }
+
+    # Transport engines, selected by config 'ENGINE'
+    ENGINES = {
+        'robobrowser': RoboBrowserEngine,
+        'http': HttpEngine
+    }
 
     # Source: DKB IBAN
     # Target: DKB IBAN
@@ -25,36 +50,59 @@ class Dkb:
     # Source: DKB CreditCard
     # Target: DKB IBAN
     TRANSACTIONTYPE_CREDITCARD_CHECKING = 'CREDITCARD_CHECKING'
+    # Transaction types, which need to be approved by TAN
+    TAN_TRANSACTIONTYPES = [ TRANSACTIONTYPE_CHECKING_CHECKING_LOCAL, TRANSACTIONTYPE_CHECKING_CHECKING_REMOTE ]
 
-    def __init__(self):
+    def __init__(self, metrics=None, sessionStore=None):
+        # metrics: 'DkbMetrics' instance, by default created as configured by c['METRICS_SINK']
+        # sessionStore: path of the session file, by default c['SESSION_STORE']
         self._logger = logging.getLogger(self.__class__.__name__)
-        browser = RoboBrowser(parser='lxml')
-        browser.open(Dkb.BASEURL + Dkb.SERVICE_LOGIN)
-        if browser.state.response.status_code != 200:
-            msg = str(browser.state.response.status_code) + " - " + browser.state.response.reason
-            self._logger.error("ERROR: Can not open website: " + msg)
-            raise WebsiteNotLoadable(msg)
-        self._browser = browser
+        # Metrics created from the config are finished on logout, passed ones by their owner
+        self._closeMetrics = metrics is None
+        self._metrics = metrics if metrics is not None else DkbMetrics.create()
+        self._engine = Dkb.ENGINES[config.c['ENGINE']]()
+        if self._metrics:
+            self._engine = InstrumentedEngine(self._engine, self._metrics)
         self._loggedIn = False
         self._accounts = None
+        self._accountsFetched = None
+        self._currentAmount = None
+        self._sessionPath = sessionStore if sessionStore is not None else config.c['SESSION_STORE']
+        self._sessionStore = None
+        # Credentials of a resumed session, kept until the session is confirmed by the server
+        self._resumeCredentials = None
 
     def login(self, userid, pin):
         self._logger.info("Starting login as user %s...", userid)
-        form = self._browser.get_form(id='login')
+        with self._step('login'):
+            if self._sessionPath:
+                from SessionStore import SessionStore
+                self._sessionStore = SessionStore(self._sessionPath, userid, pin)
+                if self._resumeSession(userid, pin):
+                    return True
+            return self._fullLogin(userid, pin)
+
+    def _fullLogin(self, userid, pin):
+        self._engine.open(Dkb.BASEURL + Dkb.SERVICE_LOGIN)
+        if self._engine.status != 200:
+            msg = str(self._engine.status) + " - " + self._engine.reason
+            self._logger.error("ERROR: Can not open website: " + msg)
+            raise WebsiteNotLoadable(msg)
+        form = self._engine.form(id='login')
         if not form:
             msg = "Login form not found. Probably the website changed."
             self._logger.error("ERROR: " + msg)
             raise WebsiteNotLoadable(msg)
-        form['j_username'].value = userid
-        form['j_password'].value = pin
-        form['jsEnabled'].value = "false"
-        form['browserName'].value = "Firefox"
-        form['browserVersion'].value = "40"
-        form['screenWidth'].value = "1024"
-        form['screenHeight'].value = "768"
-        form['osName'].value = "Windows"
-        self._browser.submit_form(form)
-        if self._browser.state.response.status_code != 200 or not re.search(r'/DkbTransactionBanking/content/banking/financialstatus/FinancialComposite/FinancialStatus.xhtml', self._browser.state.response.url):
+        form.set('j_username', userid)
+        form.set('j_password', pin)
+        form.set('jsEnabled', "false")
+        form.set('browserName', "Firefox")
+        form.set('browserVersion', "40")
+        form.set('screenWidth', "1024")
+        form.set('screenHeight', "768")
+        form.set('osName', "Windows")
+        self._engine.submit(form)
+        if self._engine.status != 200 or not re.search(r'/DkbTransactionBanking/content/banking/financialstatus/FinancialComposite/FinancialStatus.xhtml', self._engine.url):
             msg = "Login failed :-("
             self._logger.error("ERROR: " + msg)
             return False
@@ -62,14 +110,70 @@ class Dkb:
         self._loggedIn = True
         # Fetch list of available accounts
         self._getAccounts()
+        self._saveSession()
+        return True
+
+    def _resumeSession(self, userid, pin):
+        # Restore cookies and account snapshot of a previous run without any request. The session is
+        # verified with the first page opened, an expired session falls back to a full login.
+        state = self._sessionStore.load()
+        if not state or state['baseurl'] != Dkb.BASEURL:
+            return False
+        self._engine.setCookies(state['cookies'])
+        self._accounts = { a['number']: DkbAccount(a['number'], a['type'], Amount.fromCents(a['balance']), a['group_idx'], a['row_idx'], a['remittance']) for a in state['accounts'] }
+        age = time.time() - state['fetched']
+        self._accountsFetched = time.monotonic() - age if age < config.c['ACCOUNTS_MAX_AGE'] else None
+        self._loggedIn = True
+        self._resumeCredentials = (userid, pin)
+        self._logger.info("Session of previous run resumed (account snapshot %d s old).", age)
+        return True
+
+    def _saveSession(self):
+        if not self._sessionStore or not self._loggedIn:
+            return
+        fetched = time.time() - (time.monotonic() - self._accountsFetched) if self._accountsFetched is not None else 0
+        self._sessionStore.save({
+            'baseurl': Dkb.BASEURL,
+            'cookies': self._engine.cookies(),
+            'fetched': fetched,
+            'accounts': [ { 'number': a.number, 'type': a.type, 'balance': a.balance.cents, 'group_idx': a.group_idx, 'row_idx': a.row_idx, 'remittance': a.remittance } for a in self._accounts.values() ]
+        })
+
+    def _open(self, url):
+        # Open 'url'. Returns True, if a resumed session turned out to be expired and a full login was done.
+        self._engine.open(url)
+        if self._resumeCredentials is None:
+            return False
+        userid, pin = self._resumeCredentials
+        self._resumeCredentials = None
+        if urlsplit(self._engine.url).path != Dkb.SERVICE_LOGIN and self._engine.form(id='login') is None:
+            return False
+        self._logger.info("Resumed session expired, login again.")
+        self._loggedIn = False
+        if not self._fullLogin(userid, pin):
+            raise WebsiteNotLoadable("Login failed after expired session.")
         return True
 
     def logout(self):
-        if not self._loggedIn:
+        # Also after a failed login: metrics created from the config are finished once
+        try:
+            if self._loggedIn:
+                with self._step('logout'):
+                    self._logout()
+        finally:
+            if self._metrics and self._closeMetrics:
+                self._closeMetrics = False
+                self._metrics.close()
+
+    def _logout(self):
+        if self._sessionStore:
+            # Keep the server session alive to resume it in the next run
+            self._saveSession()
+            self._loggedIn = False
+            self._logger.info("Session stored for resume, no logout.")
             return
-        logout = self._browser.find("a", id="logout")
-        self._browser.follow_link(logout)
-        if self._browser.state.response.status_code != 200:
+        self._engine.followLink('logout')
+        if self._engine.status != 200:
             msg = "Logout failed, something went wrong."
             self._logger.error("ERROR: " + msg)
             raise WebsiteNotLoadable(msg)
@@ -78,26 +182,82 @@ class Dkb:
 
     def getBalance(self, account):
         assert account in self._accounts
-        return self._accounts[account]['balance']
+        return self._accounts[account].balance
 
-    def remittance(self, source, target, amount, creditorName=None, purpose=None):
-        # Sanitize input
-        assert source in self._accounts
-        assert re.match(r'([A-Z]{2}[0-9]{20})|([0-9]{4}\*{8}[0-9]{4})', target)
-        # Update balance information
-        self._getAccounts()
-        # Determine transaction type (Giro -> CreditCard, Giro -> Giro, CreditCard -> Giro)
+    def getAccounts(self):
+        # Current account snapshot: { number: DkbAccount }
+        return self._accounts
+
+    def transactionType(self, source, target):
+        return Dkb.route(self._accounts, source, target)
+
+    @staticmethod
+    def route(accounts, source, target):
+        # Determine transaction type (Giro -> CreditCard, Giro -> Giro, CreditCard -> Giro) on the
+        # account snapshot 'accounts', None if not supported
         transaction_type = None
-        if source in self._accounts and self._accounts[source]['type'] == Dkb.ACCTYPE_CHECKING:
-            if not target in self._accounts:
+        if source in accounts and accounts[source].type == Dkb.ACCTYPE_CHECKING:
+            if not target in accounts:
                 transaction_type = Dkb.TRANSACTIONTYPE_CHECKING_CHECKING_REMOTE
-            elif self._accounts[target]['type'] == Dkb.ACCTYPE_CHECKING:
+            elif accounts[target].type == Dkb.ACCTYPE_CHECKING:
                 transaction_type = Dkb.TRANSACTIONTYPE_CHECKING_CHECKING_LOCAL
-            elif self._accounts[target]['type'] == Dkb.ACCTYPE_CREDITCARD:
+            elif accounts[target].type == Dkb.ACCTYPE_CREDITCARD:
                 transaction_type = Dkb.TRANSACTIONTYPE_CHECKING_CREDITCARD
-        if source in self._accounts and self._accounts[source]['type'] == Dkb.ACCTYPE_CREDITCARD:
-            if target in self._accounts and self._accounts[target]['type'] == Dkb.ACCTYPE_CHECKING:
+        if source in accounts and accounts[source].type == Dkb.ACCTYPE_CREDITCARD:
+            if target in accounts and accounts[target].type == Dkb.ACCTYPE_CHECKING:
                 transaction_type = Dkb.TRANSACTIONTYPE_CREDITCARD_CHECKING
+        return transaction_type
+
+    def fetchTransactions(self, account, cache):
+        # Add the transactions of checking 'account' booked since the cursor of 'cache' ('TransactionCache') to it.
+        # The CSV export is parsed while it is downloaded. Returns the number of new transactions.
+        assert account in self._accounts and self._accounts[account].type == Dkb.ACCTYPE_CHECKING
+        since = cache.since(account)
+        with self._step('transactions.search'):
+            url = Dkb.BASEURL + Dkb.SERVICE_TRANSACTIONS + '?$event=init'
+            if self._open(url):
+                self._engine.open(url)
+            form = self._engine.form()
+            if self._engine.status != 200 or form is None:
+                msg = "Transaction search not found. Probably the website changed."
+                self._logger.error("ERROR: " + msg)
+                raise WebsiteNotLoadable(msg)
+            accountLabel = None
+            for al in form.labels('slAllAccounts'):
+                if re.sub(r'\s', '', al).startswith(account):
+                    accountLabel = al
+                    break
+            if accountLabel is None:
+                raise WebsiteNotLoadable("Account '" + account + "' not found in transaction search.")
+            form.select('slAllAccounts', accountLabel)
+            # Booked transactions of the period from 'since' until today
+            form.check('searchPeriodRadio', '1')
+            form.set('transactionDate', since.strftime('%d.%m.%Y'))
+            form.set('toTransactionDate', datetime.date.today().strftime('%d.%m.%Y'))
+            self._engine.submit(form)
+        with self._step('transactions.export'):
+            status, lines = self._engine.download(Dkb.BASEURL + Dkb.SERVICE_TRANSACTIONS + '?$event=csvExport')
+            try:
+                if status != 200:
+                    raise WebsiteNotLoadable("Transaction export failed: " + str(status))
+                for transaction in DkbParser.transactions(line.decode(Dkb.CSV_ENCODING) for line in lines):
+                    if transaction.date < since:
+                        # Export is sorted by booking date, newest first
+                        break
+                    cache.add(account, transaction)
+            finally:
+                lines.close()
+        count = cache.commit(account)
+        self._logger.info("%d new transactions of '%s' since %s.", count, account, since.isoformat())
+        return count
+
+    def remittance(self, source, target, amount, creditorName=None, purpose=None):
+        # Sanitize input
+        assert source in self._accounts
+        assert re.match(r'([A-Z]{2}[0-9]{20})|([0-9]{4}\*{8}[0-9]{4})', target)
+        # Update balance information, if the cached account snapshot is expired
+        refreshed = self._refreshAccounts()
+        transaction_type = self.transactionType(source, target)
         assert transaction_type is not None
         # Sanitize remittance parameters
         if transaction_type == Dkb.TRANSACTIONTYPE_CHECKING_CHECKING_REMOTE:
@@ -108,21 +268,27 @@ class Dkb:
         # Get amount object
         amount = Amount(amount)
         ### Sanitizing and preparation done - initiate transaction
-        # Navigate to account overview and select source account
-        self._browser.open(Dkb.BASEURL + Dkb.SERVICE_FINANCIAL_STATUS)
-        accountSelector = self._browser.select('tr#gruppe-' + str(self._accounts[source]['group_idx']) + '_' + str(self._accounts[source]['row_idx']))
-        if not len(accountSelector) > 0:
-            raise WebsiteNotLoadable("Account element not found.")
         # Check if transaction amount is covered by balance
-        if not self._accounts[source]['balance'].canCoverTransactionAmount(amount):
+        if not self._accounts[source].balance.canCoverTransactionAmount(amount) and not refreshed:
+            # Local ledger might be outdated (e.g. incoming transactions) - verify with the server
+            self._getAccounts()
+        if not self._accounts[source].balance.canCoverTransactionAmount(amount):
             msg = "Balance of account '" + source + "' not sufficient to initiate transaction of " + amount.get() + " EUR."
             self._logger.warning("WARNING: " + msg)
             raise BalanceNotSufficient(msg)
         # Navigate to transaction page of the designated source account
-        remittance = accountSelector[0].select('a[tid="remittance"]')
-        if not len(remittance) > 0:
+        remittance = self._accounts[source].remittance
+        if not remittance:
             raise WebsiteNotLoadable("Remittance element not found for '" + source + "'.")
-        self._browser.follow_link(remittance[0])
+        with self._step('remittance.open'):
+            if self._open(urljoin(Dkb.BASEURL + Dkb.SERVICE_FINANCIAL_STATUS, remittance)):
+                # Session renewed - follow the link of the fresh account snapshot
+                if not self._accounts[source].balance.canCoverTransactionAmount(amount):
+                    msg = "Balance of account '" + source + "' not sufficient to initiate transaction of " + amount.get() + " EUR."
+                    self._logger.warning("WARNING: " + msg)
+                    raise BalanceNotSufficient(msg)
+                self._engine.open(urljoin(Dkb.BASEURL + Dkb.SERVICE_FINANCIAL_STATUS, self._accounts[source].remittance))
+        self._currentAmount = amount
         if transaction_type == Dkb.TRANSACTIONTYPE_CREDITCARD_CHECKING:
             # For creditcard to checking transactions, skip step 2 - go directly to step 3
             ### Step 3 - Amount input and transaction review
@@ -130,56 +296,44 @@ class Dkb:
             self._currentTransaction = self._reviewCreditcardToCheckingRemittance()
         else:
             ### Step 2 - Account selector and transaction details
-            form = self._browser.get_forms()[2]
+            self._creditorSelection(target, creditorName)
+            ### Step 3 - Amount input and transaction review
+            if transaction_type == Dkb.TRANSACTIONTYPE_CHECKING_CREDITCARD:
+                # Target account is creditcard
+                self._creditCardRemittance(amount)
+                self._currentTransaction = self._reviewCheckingToCreditcardRemittance()
+            else:
+                # transaction_type in [ Dkb.TRANSACTIONTYPE_CHECKING_CHECKING_LOCAL, Dkb.TRANSACTIONTYPE_CHECKING_CHECKING_REMOTE ]
+                # Target account is checking
+                self._checkingRemittance(amount, purpose)
+                self._currentTransaction = self._reviewCheckingRemittance()
+        return self._currentTransaction
+
+    def _creditorSelection(self, target, creditorName):
+        with self._step('remittance.creditor'):
+            form = self._engine.form()
             assert form is not None
             # Check if target account is hosted by this DKB account ('own account')
             accountLabel = None
-            for al in form['slOwnCreditorAccounts'].labels:
+            for al in form.labels('slOwnCreditorAccounts'):
                 if re.match(re.sub(r'\*', '', target), re.sub(r'[\s\*]', '', al)):
                     # Success, target account is local
                     accountLabel = al
                     break
             if accountLabel:
                 # Select 'own account' (option: 2) transaction
-                ### REMARK: Current robobrowser forms serializer implementation stumbles over multiple radio select fields having the same name.
-                ###         As workaround, drop all select fields with the same name (poplist), choose the first one, that is enabled,
-                ###         set the value and reinsert this one to the forms processor.
-                for c in form.fields.poplist('creditorAccountType'):
-                    if not c.disabled:
-                        break
-                c.options = ['2']
-                c.value = '2'
-                form.fields.add('creditorAccountType', c)
+                form.check('creditorAccountType', '2')
                 # Select target account
-                form['slOwnCreditorAccounts'].value = accountLabel
+                form.select('slOwnCreditorAccounts', accountLabel)
             else:
                 # Account is not local - do transaction to another bank
                 # Select 'foreign account' (option: 1) transaction
-                ### REMARK: Current robobrowser forms serializer implementation stumbles over multiple radio select fields having the same name.
-                ###         As workaround, drop all select fields with the same name (poplist), choose the first one, that is enabled,
-                ###         set the value and reinsert this one to the forms processor.
-                for c in form.fields.poplist('creditorAccountType'):
-                    if not c.disabled:
-                        break
-                c.options = ['1']
-                c.value = '1'
-                form.fields.add('creditorAccountType', c)
+                form.check('creditorAccountType', '1')
                 # Fill in target account information
-                form['creditorName'].value = creditorName
-                form['creditorAccountNo'].value = target
+                form.set('creditorName', creditorName)
+                form.set('creditorAccountNo', target)
             # Submit and proceed with step 3
-            self._browser.submit_form(form)
-            ### Step 3 - Amount input and transaction review
-            if transaction_type == Dkb.TRANSACTIONTYPE_CHECKING_CREDITCARD:
-                # Target account is creditcard
-                self._creditCardRemittance(amount)
-                self._currentTransaction = self._reviewCheckingToCreditcardRemittance()
-            else:
-                # transaction_type in [ Dkb.TRANSACTIONTYPE_CHECKING_CHECKING_LOCAL, Dkb.TRANSACTIONTYPE_CHECKING_CHECKING_REMOTE ]
-                # Target account is checking
-                self._checkingRemittance(amount, purpose)
-                self._currentTransaction = self._reviewCheckingRemittance()
-        return self._currentTransaction
+            self._engine.submit(form)
 
     def approveCurrentTransaction(self, source, target, amount, tan=None):
         if source != self._currentTransaction['source'] or target != self._currentTransaction['target'] or amount != self._currentTransaction['amount']:
@@ -187,186 +341,111 @@ class Dkb:
             self._logger.error("ERROR: " + msg)
             assert False
         if not config.c['DRYRUN']:
-            form = self._browser.get_forms()[2]
-            assert form is not None
-            # Fill in TAN, if needed
-            if target not in self._accounts or (self._accounts[source]['type'] == Dkb.ACCTYPE_CHECKING and self._accounts[target]['type'] == Dkb.ACCTYPE_CHECKING):
-                assert tan
-                form['tan'].value = tan
-            self._browser.submit_form(form)
-            successBlock = self._browser.find(class_=re.compile(r'successBox', re.I))
-            if not successBlock:
-                failBlock = self._browser.find(class_=re.compile(r'errorMessage', re.I))
-                msg = failBlock.ul.text if failBlock else ""
-                msg = "Transaction failed for '" + source + "' => '" + target + "' (" + amount + "). REASON: " + msg
-                self._logger.error("ERROR: " + msg)
-                raise TransactionFailed(msg)
-            msg = successBlock.ul.li.text
-            self._logger.info("Transaction successful: " + msg)
+            with self._step('approve'):
+                form = self._engine.form()
+                assert form is not None
+                # Fill in TAN, if needed
+                if self.transactionType(source, target) in Dkb.TAN_TRANSACTIONTYPES:
+                    assert tan
+                    form.set('tan', tan)
+                self._engine.submit(form)
+                page = self._parse()
+                msg = page.successMessage()
+                if msg is None:
+                    msg = page.errorMessage()
+                    msg = "Transaction failed for '" + source + "' => '" + target + "' (" + amount + "). REASON: " + msg
+                    self._logger.error("ERROR: " + msg)
+                    # Server state is unknown now, force refetch of the account snapshot
+                    self._accountsFetched = None
+                    raise TransactionFailed(msg)
+                self._logger.info("Transaction successful: " + msg)
+                self._applyToLedger(source, target, self._currentAmount)
+                self._saveSession()
         else:
             self._logger.info("DRYRUN transaction successful: " + str(tan))
         return True
 
     def _getAccounts(self):
-        checkingTypes = [ "Girokonto" ]
-        creditcardTypes = [ "Kreditkarte", "DKB-VISA-Tagesgeld" ]
         if not self._loggedIn:
             return None
-        self._browser.open(Dkb.BASEURL + Dkb.SERVICE_FINANCIAL_STATUS)
-        accounts = {}
-        row_idx = 0
-        group_idx = 0
-        while True:
-            # Test if another account exists.
-            accountSelector = self._browser.select('tr#gruppe-' + str(group_idx) + '_' + str(row_idx))
-            if not len(accountSelector) > 0:
-                if row_idx == 0:
-                    break
-                row_idx = 0
-                group_idx += 1
-                continue
-            # Extract account information.
-            ## Account type
-            accountType = accountSelector[0].select('td div.forceWrap')
-            if not len(accountType) > 0:
-                raise WebsiteNotLoadable("Website element not found.")
-            accountType = accountType[0].string.strip()
-            if accountType in checkingTypes:
-                accountType = Dkb.ACCTYPE_CHECKING
-            elif accountType in creditcardTypes:
-                accountType = Dkb.ACCTYPE_CREDITCARD
-            else:
-                msg = "Account type '" + accountType + "' can not be mapped. Exiting."
-                self._logger.error("ERROR: " + msg)
-                raise WebsiteNotLoadable(msg)
-            ## IBAN or card number
-            iban = accountSelector[0].select('td div.iban')
-            if not len(iban) > 0:
-                raise WebsiteNotLoadable("Website element not found.")
-            iban = iban[0].string.strip()
-            iban = re.sub(r'\s', '', iban)
-            assert len(iban) > 0
-            ## Current balance
-            balance = accountSelector[0].select('td.amount span')
-            if not len(balance) > 0:
-                raise WebsiteNotLoadable("Website element not found.")
-            balance = Amount(balance[0].string.strip())
-            # Assemble account status
-            self._logger.info("Account: " + accountType + " - " + iban + " - " + balance.get())
-            accounts[iban] = {
-                'type': accountType,
-                'balance': balance,
-                'group_idx': group_idx,
-                'row_idx': row_idx
-            }
-            row_idx += 1
-        self._accounts = accounts
+        with self._step('accounts'):
+            if self._open(Dkb.BASEURL + Dkb.SERVICE_FINANCIAL_STATUS):
+                # Accounts fetched by the renewed login
+                return
+            accounts = self._parse().accounts(Dkb.ACCOUNT_TYPES)
+            for account in accounts.values():
+                self._logger.info("Account: " + account.type + " - " + account.number + " - " + account.balance.get())
+            if self._accounts:
+                for iban in accounts:
+                    if iban in self._accounts and accounts[iban].balance != self._accounts[iban].balance:
+                        self._logger.info("Balance of '" + iban + "' changed on server: " + self._accounts[iban].balance.get() + " => " + accounts[iban].balance.get())
+            self._accounts = accounts
+            self._accountsFetched = time.monotonic()
+
+    def _refreshAccounts(self):
+        # Refetch account snapshot, if it is older than the configured staleness bound
+        if self._accountsFetched is None or time.monotonic() - self._accountsFetched >= config.c['ACCOUNTS_MAX_AGE']:
+            self._getAccounts()
+            return True
+        return False
+
+    def _applyToLedger(self, source, target, amount):
+        # Book a successful transaction on the local account snapshot
+        if source not in self._accounts or amount is None:
+            self._logger.warning("WARNING: Transaction can not be booked locally, account snapshot invalidated.")
+            self._accountsFetched = None
+            return
+        self._accounts[source].balance -= amount
+        if target in self._accounts:
+            self._accounts[target].balance += amount
+        self._currentAmount = None
 
     def _creditCardRemittance(self, amount):
         # Select 'amount' form
-        form = self._browser.get_forms()[2]
-        assert form is not None
-        form['amountToTransfer'].value = amount.get()
-        self._browser.submit_form(form)
+        with self._step('remittance.amount'):
+            form = self._engine.form()
+            assert form is not None
+            form.set('amountToTransfer', amount.get())
+            self._engine.submit(form)
 
     def _checkingRemittance(self, amount, purpose):
         # Select 'amount' and 'purpose' form
-        form = self._browser.get_forms()[2]
-        assert form is not None
-        form['amountToTransfer'].value = amount.get()
-        form['paymentPurposeLine'].value = purpose
-        self._browser.submit_form(form)
+        with self._step('remittance.amount'):
+            form = self._engine.form()
+            assert form is not None
+            form.set('amountToTransfer', amount.get())
+            form.set('paymentPurposeLine', purpose)
+            self._engine.submit(form)
 
     def _reviewCheckingToCreditcardRemittance(self):
-        result = {}
-        # Select approval fields for review
-        value = self._browser.find(id='outOrderingCustomerAccount')
-        assert value
-        result['source'] = self._extractIbanOrCreditcardNumber(value.string)
-        value = self._browser.find(id='outOwnPayeeAccount')
-        assert value
-        result['target'] = self._extractIbanOrCreditcardNumber(value.string)
-        value = self._browser.find(id='outAmountToTransfer')
-        assert value
-        result['amount'] = value.string.strip()
+        with self._step('review'):
+            result = self._parse().checkingToCreditcardReview().asTransaction()
         self._logger.info("Review transaction: " + str(result))
         return result
 
     def _reviewCheckingRemittance(self):
-        result = {}
-        # Select approval fields for review
-        value = self._browser.find(id='outOrderingCustomerAccount.accountNo')
-        assert value
-        result['source'] = self._extractIbanOrCreditcardNumber(value.string)
-        value = self._browser.find(id='outCreditorAccountNo')
-        assert value
-        result['target'] = self._extractIbanOrCreditcardNumber(value.string)
-        value = self._browser.find(id='outAmountToTransfer')
-        assert value
-        result['amount'] = value.string.strip()
-        result['tan'] = True
+        with self._step('review'):
+            result = self._parse().checkingReview().asTransaction()
         self._logger.info("Review transaction: " + str(result))
         return result
 
     def _reviewCreditcardToCheckingRemittance(self):
-        result = {}
-        # Select approval fields for review
-        value = self._browser.select('#form1434775544_1 > fieldset:nth-child(2) > p:nth-child(1) > span.col65.floatRight > strong')
-        assert len(value) > 0
-        result['source'] = self._extractIbanOrCreditcardNumber(value[0].string)
-        value = self._browser.select('#form1434775544_1 > fieldset:nth-child(2) > p:nth-child(2) > span.col65.floatRight > strong')
-        assert len(value) > 0
-        result['target'] = self._extractIbanOrCreditcardNumber(value[0].string)
-        value = self._browser.select('#form1434775544_1 > fieldset:nth-child(2) > p:nth-child(3) > span.col65.floatRight > strong')
-        assert len(value) > 0
-        value = value[0].string
-        value = re.sub(r'&nbsp;', ' ', value)
-        result['amount'] = value
-        return result
+        with self._step('review'):
+            return self._parse().creditcardToCheckingReview().asTransaction()
 
-    def _extractIbanOrCreditcardNumber(self, value):
-        value = value.strip()
-        value = re.sub(r'\s', '', value)
-        value = re.sub(r'(.*)/.*', '\g<1>', value)
-        return value
-
-
-class Amount:
-    def __init__(self, amount):
-        # Input as int means expects full EUR only, no cents. ',00' will be appended.
-        if type(amount) is int:
-            self._amount = str(amount) + '00'
-        # Input as str expects EUR and cents, e.g. 23,00 or 23.50
-        elif type(amount) is str:
-            assert type(amount) is str and len(amount) >= 3
-            self._amount = re.sub(r'[\.,]', '', amount)
-        else:
-            assert False
+    def _step(self, name):
+        # Instrumentation context of a Dkb step
+        return self._metrics.step(name) if self._metrics else _NO_METRICS
+
+    def _parse(self):
+        # Parser of the current page, parse time is accounted to the current step
+        if not self._metrics:
+            return DkbParser(self._engine.content)
+        start = time.perf_counter()
+        page = DkbParser(self._engine.content)
+        self._metrics.addParse(time.perf_counter() - start)
+        return page
 
-    def get(self, decimalSeparator=','):
-        # Return amount string
-        assert decimalSeparator in [ ',', '.' ]
-        amount = self._amount
-        amount = re.sub(r'-', '', amount)
-        amount = amount[::-1]
-        # Insert decimal separator
-        amount = amount[:2] + decimalSeparator + amount[2:]
-        amount = amount[::-1]
-        amount = '-' + amount if not self._isPositive() else amount
-        return amount
-
-    def _isPositive(self):
-        return False if re.match(r'-', self._amount) else True
-
-    def canCoverTransactionAmount(self, amount):
-        if not isinstance(amount, Amount):
-            if type(amount) == int:
-                amount = str(amount) + '00'
-            amount = Amount(str(amount))
-        return int(self._amount) > int(amount._amount)
-
-class WebsiteNotLoadable(Exception):
-    pass
 
 class BalanceNotSufficient(Exception):
     pass
@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+from urllib.parse import urljoin
+
+import config
+from DkbParser import WebsiteNotLoadable
+
+# Transport engines for 'Dkb'. Both provide the same interface:
+#   open(url), submit(form), followLink(id), form(id=None) and the last response's
+#   status, reason, url and content. 'form()' without id returns the main form of
+#   a DKB page (always the third form). Forms provide labels(), set(), select() and check().
+#   cookies() and setCookies(cookies) export and restore the session cookies as plain dicts.
+#   download(url) fetches a file (e.g. a CSV export) outside the page navigation and returns its status
+#   and an iterator of its lines (bytes), which are read while they are iterated.
+# The transport libraries (robobrowser, requests, lxml) are imported when an engine is created.
+
+def _exportCookies(jar):
+    return [ { 'name': c.name, 'value': c.value, 'domain': c.domain, 'path': c.path, 'secure': c.secure, 'expires': c.expires } for c in jar ]
+
+def _importCookies(jar, cookies):
+    for c in cookies:
+        jar.set(c['name'], c['value'], domain=c['domain'], path=c['path'], secure=c['secure'], expires=c['expires'])
+
+def _download(session, url):
+    response = session.get(url, stream=True, timeout=config.c['HTTP_TIMEOUT'])
+    return response.status_code, _lines(response)
+
+def _lines(response):
+    # The connection is released, when the iterator is exhausted or closed
+    try:
+        for line in response.iter_lines():
+            yield line
+    finally:
+        response.close()
+
+
+class RoboBrowserEngine:
+    # Navigation through RoboBrowser - every inspected response is parsed into BeautifulSoup.
+    # In a bounded session (c['BOUNDED_SESSION']) only the current page is kept, the parsed tree of
+    # the previous page is released right after the next request.
+    def __init__(self):
+        from robobrowser import RoboBrowser
+        self._bounded = config.c['BOUNDED_SESSION']
+        # 'Dkb' never navigates back, the history is not needed
+        self._browser = RoboBrowser(parser='lxml', history=1 if self._bounded else True)
+
+    def open(self, url):
+        self._navigate(self._browser.open, url)
+
+    def submit(self, form):
+        self._navigate(self._browser.submit_form, form._form)
+
+    def cookies(self):
+        return _exportCookies(self._browser.session.cookies)
+
+    def setCookies(self, cookies):
+        _importCookies(self._browser.session.cookies, cookies)
+
+    def download(self, url):
+        return _download(self._browser.session, url)
+
+    def followLink(self, id):
+        link = self._browser.find('a', id=id)
+        if not link:
+            raise WebsiteNotLoadable("Link '" + id + "' not found.")
+        self._navigate(self._browser.follow_link, link)
+
+    def form(self, id=None):
+        if id:
+            form = self._browser.get_form(id=id)
+        else:
+            forms = self._browser.get_forms()
+            form = forms[2] if len(forms) > 2 else None
+        return RoboForm(form) if form else None
+
+    @property
+    def status(self):
+        return self._browser.state.response.status_code
+
+    @property
+    def reason(self):
+        return self._browser.state.response.reason
+
+    @property
+    def url(self):
+        return self._browser.state.response.url
+
+    @property
+    def content(self):
+        return self._browser.state.response.content
+
+    def _navigate(self, request, arg):
+        previous = self._browser.state if self._bounded and self._browser._states else None
+        request(arg)
+        if previous is not None:
+            # BeautifulSoup trees are reference cycles: break them, so the page is freed now and not by a later garbage collection
+            soup = previous.__dict__.pop('parsed', None)
+            if soup is not None:
+                soup.decompose()
+
+
+class RoboForm:
+    def __init__(self, form):
+        self._form = form
+
+    def labels(self, name):
+        return self._form[name].labels
+
+    def set(self, name, value):
+        self._form[name].value = value
+
+    def select(self, name, label):
+        self._form[name].value = label
+
+    def check(self, name, value):
+        ### REMARK: Current robobrowser forms serializer implementation stumbles over multiple radio select fields having the same name.
+        ###         As workaround, drop all select fields with the same name (poplist), choose the first one, that is enabled,
+        ###         set the value and reinsert this one to the forms processor.
+        for c in self._form.fields.poplist(name):
+            if not c.disabled:
+                break
+        c.options = [value]
+        c.value = value
+        self._form.fields.add(name, c)
+
+
+class HttpEngine:
+    # Navigation through a pooled keep-alive 'requests' session. Responses are parsed (lxml)
+    # only when a form or link is requested, forms are posted from plain field lists.
+    def __init__(self):
+        import requests
+        self._session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=config.c['HTTP_POOL_SIZE'], pool_maxsize=config.c['HTTP_POOL_SIZE'])
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+        self._response = None
+        self._tree = None
+
+    def open(self, url):
+        self._update(self._session.get(url, timeout=config.c['HTTP_TIMEOUT']))
+
+    def submit(self, form):
+        url = urljoin(self._response.url, form.action) if form.action else self._response.url
+        if form.method == 'GET':
+            response = self._session.get(url, params=form.fields, timeout=config.c['HTTP_TIMEOUT'])
+        else:
+            response = self._session.request(form.method, url, data=form.fields, timeout=config.c['HTTP_TIMEOUT'])
+        self._update(response)
+
+    def cookies(self):
+        return _exportCookies(self._session.cookies)
+
+    def setCookies(self, cookies):
+        _importCookies(self._session.cookies, cookies)
+
+    def download(self, url):
+        return _download(self._session, url)
+
+    def followLink(self, id):
+        link = self._parsed().get_element_by_id(id, None)
+        if link is None or not link.get('href'):
+            raise WebsiteNotLoadable("Link '" + id + "' not found.")
+        self.open(urljoin(self._response.url, link.get('href')))
+
+    def form(self, id=None):
+        if id:
+            form = self._parsed().get_element_by_id(id, None)
+            if form is not None and form.tag != 'form':
+                form = None
+        else:
+            forms = self._parsed().forms
+            form = forms[2] if len(forms) > 2 else None
+        return HttpForm(form) if form is not None else None
+
+    @property
+    def status(self):
+        return self._response.status_code
+
+    @property
+    def reason(self):
+        return self._response.reason
+
+    @property
+    def url(self):
+        return self._response.url
+
+    @property
+    def content(self):
+        return self._response.content
+
+    def _update(self, response):
+        self._response = response
+        self._tree = None
+
+    def _parsed(self):
+        if self._tree is None:
+            from lxml import html
+            self._tree = html.fromstring(self._response.content, base_url=self._response.url)
+        return self._tree
+
+
+class HttpForm:
+    # Form as ordered (name, value) field list, serialized the way RoboBrowser does:
+    # disabled fields are dropped, a single submit button is included.
+    def __init__(self, form):
+        self.action = form.get('action')
+        self.method = form.get('method', 'get').upper()
+        self._fields = []
+        self._options = {}
+        submits = []
+        radios = set()
+        for element in form.iter('input', 'select', 'textarea'):
+            name = element.get('name')
+            if not name or element.get('disabled') is not None:
+                continue
+            if element.tag == 'select':
+                options = [ (o.get('value', o.text_content()), o.text_content()) for o in element.iter('option') ]
+                self._options[name] = options
+                selected = [ o.get('value', o.text_content()) for o in element.iter('option') if o.get('selected') is not None ]
+                self._fields.append([ name, selected[0] if selected else (options[0][0] if options else '') ])
+            elif element.tag == 'textarea':
+                self._fields.append([ name, element.text or '' ])
+            else:
+                inputType = element.get('type', 'text').lower()
+                if inputType == 'submit':
+                    submits.append([ name, element.get('value', '') ])
+                    self._fields.append(submits[-1])
+                elif inputType == 'radio':
+                    # One field per radio group, holding the checked value
+                    if name not in radios:
+                        radios.add(name)
+                        self._fields.append([ name, None ])
+                    if element.get('checked') is not None:
+                        self._field(name)[1] = element.get('value', 'on')
+                elif inputType == 'checkbox':
+                    if element.get('checked') is not None:
+                        self._fields.append([ name, element.get('value', 'on') ])
+                elif inputType not in [ 'button', 'image', 'reset', 'file' ]:
+                    self._fields.append([ name, element.get('value', '') ])
+        if len(submits) > 1:
+            # No submit button is chosen by 'Dkb', drop them like an implicit submission would.
+            self._fields = [ f for f in self._fields if not any(f is submit for submit in submits) ]
+
+    @property
+    def fields(self):
+        # Serialized form data, unchecked radio groups are omitted
+        return [ (name, value) for name, value in self._fields if value is not None ]
+
+    def labels(self, name):
+        if name not in self._options:
+            raise KeyError(name)
+        return [ label for _, label in self._options[name] ]
+
+    def set(self, name, value):
+        self._field(name)[1] = value
+
+    def select(self, name, label):
+        if name not in self._options:
+            raise KeyError(name)
+        for value, l in self._options[name]:
+            if l == label or value == label:
+                self._field(name)[1] = value
+                return
+        raise ValueError("Option '" + label + "' not found in field '" + name + "'.")
+
+    def check(self, name, value):
+        self._field(name)[1] = value
+
+    def _field(self, name):
+        for field in self._fields:
+            if field[0] == name:
+                return field
+        raise KeyError(name)
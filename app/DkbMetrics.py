@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+import json
+import os
+import time
+
+import config
+
+class DkbMetrics:
+    # Timing instrumentation of 'Dkb' steps. Every step (login, accounts, remittance stages, review,
+    # approve, logout) is recorded with its latency, the HTTP requests done in it (count, time, last
+    # status, response bytes) and the time spent parsing pages. Records are handed to a sink.
+    # Steps may be nested, requests and parse time are accounted to the innermost step.
+
+    def __init__(self, sink):
+        self._sink = sink
+        self._steps = []
+
+    @staticmethod
+    def create():
+        # Metrics as configured by c['METRICS_SINK'], None if disabled
+        sink = config.c['METRICS_SINK']
+        if not sink:
+            return None
+        return DkbMetrics(SINKS[sink](config.c['METRICS_FILE']))
+
+    @property
+    def sink(self):
+        return self._sink
+
+    def step(self, name):
+        return _Step(self, name)
+
+    def addRequest(self, seconds, status, size):
+        if self._steps:
+            record = self._steps[-1].record
+            record['requests'] += 1
+            record['http'] += seconds
+            record['status'] = status
+            record['bytes'] += size
+
+    def addParse(self, seconds):
+        if self._steps:
+            self._steps[-1].record['parse'] += seconds
+
+    def close(self):
+        self._sink.close()
+
+
+class _Step:
+    __slots__ = ('_metrics', '_start', 'record')
+
+    def __init__(self, metrics, name):
+        self._metrics = metrics
+        self.record = { 'step': name, 'time': None, 'latency': 0.0, 'requests': 0, 'http': 0.0, 'status': None, 'bytes': 0, 'parse': 0.0, 'error': None }
+
+    def __enter__(self):
+        self.record['time'] = time.time()
+        self._metrics._steps.append(self)
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.record['latency'] = time.perf_counter() - self._start
+        if excType is not None:
+            self.record['error'] = excType.__name__
+        self._metrics._steps.pop()
+        self._metrics._sink.add(self.record)
+        return False
+
+
+class InstrumentedEngine:
+    # Transport engine proxy, reporting requests and form parsing to 'DkbMetrics'
+    def __init__(self, engine, metrics):
+        self._engine = engine
+        self._metrics = metrics
+
+    def open(self, url):
+        self._request(self._engine.open, url)
+
+    def submit(self, form):
+        self._request(self._engine.submit, form)
+
+    def followLink(self, id):
+        # Includes parsing the current page for the link
+        self._request(self._engine.followLink, id)
+
+    def form(self, id=None):
+        start = time.perf_counter()
+        form = self._engine.form(id)
+        self._metrics.addParse(time.perf_counter() - start)
+        return form
+
+    def cookies(self):
+        return self._engine.cookies()
+
+    def setCookies(self, cookies):
+        self._engine.setCookies(cookies)
+
+    def download(self, url):
+        # The request is reported, when the download is complete or closed
+        start = time.perf_counter()
+        status, lines = self._engine.download(url)
+        return status, self._countLines(lines, start, status)
+
+    @property
+    def status(self):
+        return self._engine.status
+
+    @property
+    def reason(self):
+        return self._engine.reason
+
+    @property
+    def url(self):
+        return self._engine.url
+
+    @property
+    def content(self):
+        return self._engine.content
+
+    def _countLines(self, lines, start, status):
+        size = 0
+        try:
+            for line in lines:
+                size += len(line) + 1
+                yield line
+        finally:
+            lines.close()
+            self._metrics.addRequest(time.perf_counter() - start, status, size)
+
+    def _request(self, fn, arg):
+        start = time.perf_counter()
+        fn(arg)
+        self._metrics.addRequest(time.perf_counter() - start, self._engine.status, len(self._engine.content))
+
+
+class MemorySink:
+    # In-memory histogram of step latencies
+    BUCKETS = [ 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0 ]
+
+    def __init__(self, path=None):
+        self.steps = {}
+
+    def add(self, record):
+        step = self.steps.get(record['step'])
+        if step is None:
+            step = self.steps[record['step']] = { 'count': 0, 'buckets': [ 0 ] * len(MemorySink.BUCKETS), 'latency': 0.0, 'max': 0.0, 'requests': 0, 'http': 0.0, 'bytes': 0, 'parse': 0.0, 'errors': 0, 'status': {} }
+        latency = record['latency']
+        step['count'] += 1
+        for i, bound in enumerate(MemorySink.BUCKETS):
+            if latency <= bound:
+                step['buckets'][i] += 1
+        step['latency'] += latency
+        step['max'] = max(step['max'], latency)
+        step['requests'] += record['requests']
+        step['http'] += record['http']
+        step['bytes'] += record['bytes']
+        step['parse'] += record['parse']
+        if record['error']:
+            step['errors'] += 1
+        if record['status'] is not None:
+            step['status'][record['status']] = step['status'].get(record['status'], 0) + 1
+
+    def quantile(self, name, q):
+        # Upper bucket bound of quantile 'q' of the latencies of step 'name' (None, if beyond the last bucket)
+        step = self.steps[name]
+        for bound, count in zip(MemorySink.BUCKETS, step['buckets']):
+            if count >= q * step['count']:
+                return bound
+        return None
+
+    def close(self):
+        pass
+
+
+class JsonLinesSink:
+    # Trace of all step records, one JSON object per line
+    def __init__(self, path):
+        self._fp = open(path, 'a', encoding='utf-8')
+
+    def add(self, record):
+        self._fp.write(json.dumps(record) + '\n')
+        self._fp.flush()
+
+    def close(self):
+        self._fp.close()
+
+
+class PrometheusSink(MemorySink):
+    # Aggregated metrics in Prometheus text format (e.g. for the node exporter textfile collector), written on close
+    def __init__(self, path):
+        super().__init__()
+        self._path = path
+
+    def close(self):
+        lines = [
+            '# HELP dkb_step_duration_seconds Latency of Dkb steps.',
+            '# TYPE dkb_step_duration_seconds histogram'
+        ]
+        for name, step in sorted(self.steps.items()):
+            for bound, count in zip(MemorySink.BUCKETS, step['buckets']):
+                lines.append('dkb_step_duration_seconds_bucket{step="%s",le="%s"} %d' % (name, bound, count))
+            lines.append('dkb_step_duration_seconds_bucket{step="%s",le="+Inf"} %d' % (name, step['count']))
+            lines.append('dkb_step_duration_seconds_sum{step="%s"} %.6f' % (name, step['latency']))
+            lines.append('dkb_step_duration_seconds_count{step="%s"} %d' % (name, step['count']))
+        counters = [
+            ('dkb_step_requests_total', 'HTTP requests of Dkb steps.', 'requests', '%d'),
+            ('dkb_step_http_seconds_total', 'Time spent in HTTP requests of Dkb steps.', 'http', '%.6f'),
+            ('dkb_step_response_bytes_total', 'Response bytes received in Dkb steps.', 'bytes', '%d'),
+            ('dkb_step_parse_seconds_total', 'Time spent parsing pages in Dkb steps.', 'parse', '%.6f'),
+            ('dkb_step_errors_total', 'Dkb steps failed with an exception.', 'errors', '%d')
+        ]
+        for metric, description, key, fmt in counters:
+            lines.append('# HELP ' + metric + ' ' + description)
+            lines.append('# TYPE ' + metric + ' counter')
+            for name, step in sorted(self.steps.items()):
+                lines.append(('%s{step="%s"} ' + fmt) % (metric, name, step[key]))
+        lines.append('# HELP dkb_step_http_status_total Last HTTP status of Dkb steps.')
+        lines.append('# TYPE dkb_step_http_status_total counter')
+        for name, step in sorted(self.steps.items()):
+            for status, count in sorted(step['status'].items()):
+                lines.append('dkb_step_http_status_total{step="%s",code="%d"} %d' % (name, status, count))
+        # Replace atomically, a collector must never read a partial file
+        tmp = self._path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as fp:
+            fp.write('\n'.join(lines) + '\n')
+        os.replace(tmp, self._path)
+
+
+# Sinks, selected by config 'METRICS_SINK'
+SINKS = {
+    'memory': MemorySink,
+    'jsonl': JsonLinesSink,
+    'prometheus': PrometheusSink
+}
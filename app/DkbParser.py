@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+import csv
+import datetime
+import re
+
+from Amount import Amount
+
+class DkbParser:
+    # Single pass page parser. The document is walked once to build an index of all
+    # elements having an id and of all account rows ('tr#gruppe-<group>_<row>').
+    # lxml is imported on first use, so importing the parser does not load the HTML stack.
+    REVIEW_CREDITCARD_FORM = 'form1434775544_1'
+    # Columns of the checking account CSV export, as used by 'DkbTransaction'
+    CSV_COLUMNS = [ 'Buchungstag', 'Wertstellung', 'Buchungstext', 'Auftraggeber / Begünstigter', 'Verwendungszweck', 'Kontonummer', 'Betrag (EUR)' ]
+
+    _reAccountRow = re.compile(r'gruppe-(\d+)_(\d+)$')
+    _reSuccessBox = re.compile(r'successBox', re.I)
+    _reErrorMessage = re.compile(r'errorMessage', re.I)
+
+    def __init__(self, content):
+        if not content:
+            raise WebsiteNotLoadable("Empty page.")
+        from lxml import etree, html
+        self._tree = html.fromstring(content)
+        self._ids = {}
+        self._rows = []
+        for element in self._tree.iter(etree.Element):
+            elementId = element.get('id')
+            if elementId is None:
+                continue
+            self._ids[elementId] = element
+            if element.tag == 'tr':
+                m = DkbParser._reAccountRow.match(elementId)
+                if m:
+                    self._rows.append((int(m.group(1)), int(m.group(2)), element))
+
+    def accounts(self, accountTypes):
+        # accountTypes: map of account type label (as shown on the website) to account type
+        accounts = {}
+        for group_idx, row_idx, row in self._rows:
+            typeLabel = iban = balance = remittance = None
+            for element in row.iter('div', 'span', 'a'):
+                classes = element.get('class', '').split()
+                if element.tag == 'div' and 'forceWrap' in classes and typeLabel is None:
+                    typeLabel = element.text_content().strip()
+                elif element.tag == 'div' and 'iban' in classes and iban is None:
+                    iban = re.sub(r'\s', '', element.text_content())
+                elif element.tag == 'span' and balance is None and 'amount' in element.getparent().get('class', '').split():
+                    balance = element.text_content().strip()
+                elif element.tag == 'a' and element.get('tid') == 'remittance' and remittance is None:
+                    remittance = element.get('href')
+            if typeLabel is None or not iban or balance is None:
+                raise WebsiteNotLoadable("Website element not found.")
+            if typeLabel not in accountTypes:
+                raise WebsiteNotLoadable("Account type '" + typeLabel + "' can not be mapped.")
+            accounts[iban] = DkbAccount(iban, accountTypes[typeLabel], Amount(balance), group_idx, row_idx, remittance)
+        return accounts
+
+    def checkingReview(self):
+        # Checking to checking (local and remote), TAN needed
+        return DkbReview(
+            self._reviewNumber('outOrderingCustomerAccount.accountNo'),
+            self._reviewNumber('outCreditorAccountNo'),
+            self._text('outAmountToTransfer'),
+            True
+        )
+
+    def checkingToCreditcardReview(self):
+        return DkbReview(
+            self._reviewNumber('outOrderingCustomerAccount'),
+            self._reviewNumber('outOwnPayeeAccount'),
+            self._text('outAmountToTransfer'),
+            False
+        )
+
+    def creditcardToCheckingReview(self):
+        # The review form has no ids on its fields: second child element of the form
+        # is a fieldset holding source, target and amount as 'p > span.col65.floatRight > strong'.
+        form = self._ids.get(DkbParser.REVIEW_CREDITCARD_FORM)
+        children = [ e for e in form if isinstance(e.tag, str) ] if form is not None else []
+        if len(children) < 2 or children[1].tag != 'fieldset':
+            raise WebsiteNotLoadable("Review element not found.")
+        values = []
+        for p in children[1].iterchildren('p'):
+            for span in p.iterchildren('span'):
+                classes = span.get('class', '').split()
+                if 'col65' in classes and 'floatRight' in classes:
+                    strong = span.find('strong')
+                    if strong is not None:
+                        values.append(strong.text_content())
+                    break
+        if len(values) < 3:
+            raise WebsiteNotLoadable("Review element not found.")
+        return DkbReview(
+            DkbParser.extractIbanOrCreditcardNumber(values[0]),
+            DkbParser.extractIbanOrCreditcardNumber(values[1]),
+            values[2].replace('\xa0', ' ').strip(),
+            False
+        )
+
+    def successMessage(self):
+        # Text of the first success message entry, None if the page has no success box
+        box = self._findByClass(DkbParser._reSuccessBox)
+        if box is None:
+            return None
+        item = box.find('.//li')
+        return (item if item is not None else box).text_content().strip()
+
+    def errorMessage(self):
+        box = self._findByClass(DkbParser._reErrorMessage)
+        if box is None:
+            return ""
+        items = box.find('.//ul')
+        return (items if items is not None else box).text_content()
+
+    def _findByClass(self, pattern):
+        from lxml import etree
+        for element in self._tree.iter(etree.Element):
+            classes = element.get('class')
+            if classes and pattern.search(classes):
+                return element
+        return None
+
+    def _text(self, elementId):
+        element = self._ids.get(elementId)
+        if element is None:
+            raise WebsiteNotLoadable("Website element '" + elementId + "' not found.")
+        return element.text_content().strip()
+
+    def _reviewNumber(self, elementId):
+        return DkbParser.extractIbanOrCreditcardNumber(self._text(elementId))
+
+    @staticmethod
+    def transactions(lines):
+        # Rows of a checking account CSV export ('lines': decoded text lines) in export order, newest first.
+        # The header block (account, period, balance) is skipped up to the column header, rows are parsed
+        # one at a time while 'lines' is read. Pending transactions without booking date are skipped.
+        header = None
+        for row in csv.reader(lines, delimiter=';'):
+            if header is None:
+                if row and row[0] == DkbParser.CSV_COLUMNS[0]:
+                    header = { name: i for i, name in enumerate(row) }
+                    missing = [ name for name in DkbParser.CSV_COLUMNS if name not in header ]
+                    if missing:
+                        raise WebsiteNotLoadable("Transaction export column '" + missing[0] + "' not found.")
+                    columns = [ header[name] for name in DkbParser.CSV_COLUMNS ]
+                continue
+            if len(row) <= max(columns) or not row[columns[0]]:
+                continue
+            values = [ row[i].strip() for i in columns ]
+            yield DkbTransaction(
+                datetime.datetime.strptime(values[0], '%d.%m.%Y').date(),
+                datetime.datetime.strptime(values[1], '%d.%m.%Y').date() if values[1] else None,
+                values[2],
+                values[3],
+                values[4],
+                values[5],
+                Amount(values[6])
+            )
+        if header is None:
+            raise WebsiteNotLoadable("Transaction export not found.")
+
+    @staticmethod
+    def extractIbanOrCreditcardNumber(value):
+        value = value.strip()
+        value = re.sub(r'\s', '', value)
+        value = re.sub(r'(.*)/.*', r'\g<1>', value)
+        return value
+
+
+class DkbAccount:
+    __slots__ = ('number', 'type', 'balance', 'group_idx', 'row_idx', 'remittance')
+
+    def __init__(self, number, type, balance, group_idx, row_idx, remittance):
+        self.number = number
+        self.type = type
+        self.balance = balance
+        self.group_idx = group_idx
+        self.row_idx = row_idx
+        self.remittance = remittance
+
+
+class DkbTransaction:
+    __slots__ = ('date', 'valueDate', 'text', 'party', 'purpose', 'account', 'amount')
+
+    def __init__(self, date, valueDate, text, party, purpose, account, amount):
+        self.date = date
+        self.valueDate = valueDate
+        self.text = text
+        self.party = party
+        self.purpose = purpose
+        self.account = account
+        self.amount = amount
+
+
+class DkbReview:
+    __slots__ = ('source', 'target', 'amount', 'tan')
+
+    def __init__(self, source, target, amount, tan):
+        self.source = source
+        self.target = target
+        self.amount = amount
+        self.tan = tan
+
+    def asTransaction(self):
+        # Transaction dict as returned by 'Dkb.remittance'. Key 'tan' exists only, if a TAN is required.
+        result = { 'source': self.source, 'target': self.target, 'amount': self.amount }
+        if self.tan:
+            result['tan'] = True
+        return result
+
+
+class WebsiteNotLoadable(Exception):
+    pass
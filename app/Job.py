@@ -1,8 +1,14 @@
 import logging
 import json
+import datetime
 import re
 
 from config import c
+from Amount import Amount
+from ShareEngine import ShareEngine
+
+# IBAN or credit card number, checked per job - validation must not import NumPy
+_reAccount = re.compile(r'([A-Z]{2}\d{20})|(\d{4}\*{8}\d{4})')
 
 class Job:
     JOB_NAME = "Name"
@@ -12,6 +18,8 @@ class Job:
     JOB_TARGETACCOUNT = "TargetAccount"
     JOB_REMITTEE = "Remittee"
     JOB_DESCRIPTION = "Description"
+    # Relative shares are calculated from a multiple of this income (EUR)
+    INCOME_MULTIPLE_OF = 50
 
     def __init__(self):
         self._logger = logging.getLogger(self.__class__.__name__)
@@ -34,24 +42,66 @@ class Job:
 
     def calculateShareValue(self, income):
         self._logger.info("## Calculate job amounts.")
+        relative = []
         for job in self._jobs:
             if not Job.JOB_SHAREVALUE in job:
-                job[Job.JOB_SHAREVALUE] = income * job[Job.JOB_SHARE] // 100
+                relative.append(job)
+            else:
+                job[Job.JOB_SHAREVALUE] = Amount(job[Job.JOB_SHAREVALUE])
+        if relative:
+            # All relative shares in one pass, rounding remainders are distributed to the largest ones
+            values = ShareEngine.shareValues(Amount(income).cents, [ job[Job.JOB_SHARE] for job in relative ])
+            for job, value in zip(relative, values.tolist()):
+                job[Job.JOB_SHAREVALUE] = Amount.fromCents(value)
+
+    @staticmethod
+    def checkFields(j):
+        # Returns error message, if mandatory fields of job 'j' are missing
+        if not (Job.JOB_NAME in j and Job.JOB_SOURCEACCOUNT in j and ((Job.JOB_SHARE in j) ^ (Job.JOB_SHAREVALUE in j)) and Job.JOB_TARGETACCOUNT in j):
+            return "Missing fields."
+        if len(j[Job.JOB_NAME]) <= 0:
+            return "Job name not set."
+        return None
+
+    @staticmethod
+    def isValidAccount(account):
+        # IBAN (<2 letters><20 digits>) or credit card number (<4 digits><8 asterisks><4 digits>)
+        return isinstance(account, str) and _reAccount.match(account) is not None
+
+    @staticmethod
+    def normalizeIncome(income):
+        # Shared income in full EUR rounded down to a multiple of INCOME_MULTIPLE_OF, None if it is not a positive number
+        if type(income) is not int:
+            return None
+        income = income - income % Job.INCOME_MULTIPLE_OF
+        return income if income > 0 else None
+
+    @staticmethod
+    def remittanceDetails(j):
+        # Returns creditor name and purpose of the transaction of job 'j', the purpose defaults to name and time
+        creditor = j[Job.JOB_REMITTEE] if Job.JOB_REMITTEE in j else None
+        description = j[Job.JOB_DESCRIPTION] if Job.JOB_DESCRIPTION in j else None
+        if not description:
+            description = j[Job.JOB_NAME] + " " + datetime.datetime.now().strftime("%Y.%m.%dT%H.%M.%S")
+        return creditor, description
+
+    @staticmethod
+    def checkTransaction(j, transaction):
+        # Returns error message, if the prepared 'transaction' does not match the reviewed job 'j'
+        if transaction['source'] != j[Job.JOB_SOURCEACCOUNT] or transaction['target'] != j[Job.JOB_TARGETACCOUNT] or Amount(transaction['amount']) != j[Job.JOB_SHAREVALUE]:
+            return "Prepared transaction differs from job: " + str(transaction)
+        return None
 
     def _validate(self):
         valid = True
         sumShare = 0
         for j in self._jobs:
-            if not (Job.JOB_NAME in j and Job.JOB_SOURCEACCOUNT in j and ((Job.JOB_SHARE in j) ^ (Job.JOB_SHAREVALUE in j)) and Job.JOB_TARGETACCOUNT in j):
-                self._logger.error("'job.json' is invalid: Missing fields.")
-                valid = False
-                continue
-            if len(j[Job.JOB_NAME]) <= 0:
-                self._logger.error("'job.json' is invalid: Job name not set.")
+            error = Job.checkFields(j)
+            if error:
+                self._logger.error("'job.json' is invalid: " + error)
                 valid = False
                 continue
-            reAccount = re.compile(r'([A-Z]{2}\d{20})|(\d{4}\*{8}\d{4})')
-            if not reAccount.match(j[Job.JOB_SOURCEACCOUNT]) or not reAccount.match(j[Job.JOB_TARGETACCOUNT]):
+            if not Job.isValidAccount(j[Job.JOB_SOURCEACCOUNT]) or not Job.isValidAccount(j[Job.JOB_TARGETACCOUNT]):
                 self._logger.error("'job.json' is invalid: TargetAccount or SourceAccount missing or invalid.")
                 valid = False
                 continue
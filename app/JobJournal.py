@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+import datetime
+import hashlib
+import json
+import logging
+import os
+
+import config
+from Job import Job
+
+class JobJournal:
+    # Append-only write-ahead journal of the job stages of a dispatch run. Every record is fsync'd
+    # before the run proceeds, so after a crash or abort the next run knows which jobs were approved.
+    # Jobs are identified by a fingerprint of their content and occurrence in the job file.
+    # The journal is removed when all jobs of a run are approved. A journal older than c['JOURNAL_MAX_AGE']
+    # is set aside, so the identical jobs of the next regular run (e.g. next month) are not skipped.
+    STAGE_PREPARED = 'prepared'
+    STAGE_REVIEWED = 'reviewed'
+    STAGE_APPROVED = 'approved'
+    STAGE_FAILED = 'failed'
+    # Job field holding the fingerprint, once assigned
+    JOB_FINGERPRINT = '_fingerprint'
+
+    def __init__(self, path):
+        self._logger = logging.getLogger(self.__class__.__name__)
+        self._path = path
+        self._tornTail = False
+        self._stages = self._load()
+        self._occurrences = {}
+        # Fingerprints of the jobs of this run, which are not approved yet
+        self._unfinished = set()
+        self._fp = None
+        if self._stages:
+            approved = sum(1 for stage in self._stages.values() if stage == JobJournal.STAGE_APPROVED)
+            self._logger.info("Journal '" + self._path + "' of an unfinished run found: " + str(approved) + " of " + str(len(self._stages)) + " journaled jobs approved.")
+
+    def fingerprint(self, job):
+        # Stable job id: hash of the transaction fields and the number of identical jobs before it
+        if JobJournal.JOB_FINGERPRINT not in job:
+            content = json.dumps([
+                job[Job.JOB_NAME],
+                job[Job.JOB_SOURCEACCOUNT],
+                job[Job.JOB_TARGETACCOUNT],
+                job[Job.JOB_SHAREVALUE].cents,
+                job.get(Job.JOB_REMITTEE),
+                job.get(Job.JOB_DESCRIPTION)
+            ])
+            digest = hashlib.sha256(content.encode('utf-8')).hexdigest()[:16]
+            occurrence = self._occurrences.get(digest, 0)
+            self._occurrences[digest] = occurrence + 1
+            job[JobJournal.JOB_FINGERPRINT] = digest + '-' + str(occurrence)
+            if self._stages.get(job[JobJournal.JOB_FINGERPRINT]) != JobJournal.STAGE_APPROVED:
+                self._unfinished.add(job[JobJournal.JOB_FINGERPRINT])
+        return job[JobJournal.JOB_FINGERPRINT]
+
+    def stage(self, job):
+        # Last journaled stage of 'job', None if not journaled
+        return self._stages.get(self.fingerprint(job))
+
+    def isApproved(self, job):
+        return self.stage(job) == JobJournal.STAGE_APPROVED
+
+    def isInDoubt(self, job):
+        # Confirmed, but the approval was not recorded: the transaction may have been executed
+        return self.stage(job) == JobJournal.STAGE_REVIEWED
+
+    def record(self, job, stage, detail=None):
+        entry = {
+            'time': datetime.datetime.now().isoformat(),
+            'fingerprint': self.fingerprint(job),
+            'stage': stage,
+            'name': job[Job.JOB_NAME],
+            'amount': job[Job.JOB_SHAREVALUE].get()
+        }
+        if detail:
+            entry['detail'] = detail
+        if self._fp is None:
+            self._fp = open(self._path, 'a', encoding='utf-8')
+            if self._tornTail:
+                # Terminate the torn record, so it does not corrupt the next one
+                self._fp.write('\n')
+        self._fp.write(json.dumps(entry) + '\n')
+        self._fp.flush()
+        os.fsync(self._fp.fileno())
+        self._stages[entry['fingerprint']] = stage
+        if stage == JobJournal.STAGE_APPROVED:
+            self._unfinished.discard(entry['fingerprint'])
+
+    def finish(self, complete):
+        # Close the journal. It is removed, if all jobs of the run were seen ('complete') and are approved.
+        if self._fp is not None:
+            self._fp.close()
+            self._fp = None
+        if complete and not self._unfinished:
+            try:
+                os.remove(self._path)
+            except FileNotFoundError:
+                pass
+            return True
+        self._logger.info("Unfinished jobs left, journal '" + self._path + "' kept for the next run.")
+        return False
+
+    def _load(self):
+        stages = {}
+        try:
+            fp = open(self._path, 'r', encoding='utf-8')
+        except FileNotFoundError:
+            return stages
+        with fp:
+            data = fp.read()
+            self._tornTail = len(data) > 0 and not data.endswith('\n')
+            for line in data.splitlines():
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # Torn record of a crash during write - the stage was not reached
+                    self._logger.warning("WARNING: Incomplete journal record ignored.")
+                    continue
+                if not stages:
+                    age = datetime.datetime.now() - datetime.datetime.fromisoformat(entry['time'])
+                    if age.total_seconds() > config.c['JOURNAL_MAX_AGE']:
+                        self._logger.warning("WARNING: Journal '" + self._path + "' of " + entry['time'] + " is outdated, moved to '" + self._path + ".old'.")
+                        os.replace(self._path, self._path + '.old')
+                        self._tornTail = False
+                        return {}
+                stages[entry['fingerprint']] = entry['stage']
+        return stages
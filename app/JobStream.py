@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+import logging
+import json
+import re
+
+from config import c
+from Amount import Amount
+from Job import Job
+from ShareEngine import ShareEngine
+
+class JobStream:
+    # Streaming job source. Jobs are read one at a time from a JSONL file (one job object per
+    # line) or from the 'dispatch' array of a regular job file, validated incrementally and
+    # yielded with their absolute 'ShareValue'. Relative shares are calculated like 'Job' does (largest
+    # remainder rounding over all relative jobs), so both send the same cents and journal fingerprints:
+    # on the first relative job, the shares of the whole file are read in a separate pass.
+    CHUNK_SIZE = 65536
+
+    _reDispatchArray = re.compile(r'"dispatch"\s*:\s*\[')
+    _reSeparator = re.compile(r'[\s,]*')
+
+    def __init__(self, path=None, income=None):
+        # income: shared income in EUR, or a callable inquiring it on the first relative job
+        self._logger = logging.getLogger(self.__class__.__name__)
+        self._path = path if path else c['DISPATCH_CONFIG_FILE']
+        self._income = income
+        self.count = 0
+        # Cents of the relative jobs in file order, calculated on the first relative job
+        self._shareValues = None
+        self._relativeCount = 0
+
+    @staticmethod
+    def isStreamFile(path):
+        return path.endswith('.jsonl')
+
+    def getJobs(self):
+        sumShare = 0
+        try:
+            fp = open(self._path, 'r', encoding='utf-8')
+        except Exception as e:
+            self._logger.error("ERROR: Reading job config file '" + self._path + "' (" + str(e) + ").")
+            raise
+        with fp:
+            source = self._readLines(fp) if JobStream.isStreamFile(self._path) else self._readArray(fp)
+            for j in source:
+                self.count += 1
+                error = Job.checkFields(j) if isinstance(j, dict) else "Job is not an object."
+                if not error and not (Job.isValidAccount(j[Job.JOB_SOURCEACCOUNT]) and Job.isValidAccount(j[Job.JOB_TARGETACCOUNT])):
+                    error = "TargetAccount or SourceAccount missing or invalid."
+                if not error and Job.JOB_SHARE in j:
+                    sumShare += j[Job.JOB_SHARE]
+                    if sumShare > 100:
+                        error = "Sum of shares is greater than 100%"
+                if error:
+                    msg = "'" + self._path + "' is invalid at job " + str(self.count) + ": " + error
+                    self._logger.error("ERROR: " + msg)
+                    raise JobInvalid(msg)
+                if Job.JOB_SHARE in j:
+                    j[Job.JOB_SHAREVALUE] = self._nextShareValue()
+                else:
+                    j[Job.JOB_SHAREVALUE] = Amount(j[Job.JOB_SHAREVALUE])
+                yield j
+
+    def _nextShareValue(self):
+        if self._shareValues is None:
+            self._shareValues = ShareEngine.shareValues(Amount(self._getIncome()).cents, self._scanShares())
+        value = Amount.fromCents(int(self._shareValues[self._relativeCount]))
+        self._relativeCount += 1
+        return value
+
+    def _scanShares(self):
+        # Shares of all relative jobs in file order. The scan stops at the first job, at which the main pass
+        # stops as invalid anyway - the shares up to there are the ones of the jobs remitted.
+        shares = []
+        with open(self._path, 'r', encoding='utf-8') as fp:
+            source = self._readLines(fp) if JobStream.isStreamFile(self._path) else self._readArray(fp)
+            try:
+                for j in source:
+                    if not isinstance(j, dict):
+                        break
+                    if Job.JOB_SHARE in j:
+                        share = j[Job.JOB_SHARE]
+                        if type(share) not in (int, float):
+                            break
+                        shares.append(share)
+            except JobInvalid:
+                pass
+        return shares
+
+    def _getIncome(self):
+        if callable(self._income):
+            self._income = self._income()
+        if not self._income:
+            raise JobInvalid("Income for relative shares not available.")
+        return self._income
+
+    def _readLines(self, fp):
+        for line in fp:
+            line = line.strip()
+            if line:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError as e:
+                    raise JobInvalid("'" + self._path + "' is invalid: " + str(e))
+
+    def _readArray(self, fp):
+        # Incrementally decode the objects of the 'dispatch' array, reading the file in chunks
+        decoder = json.JSONDecoder()
+        buffer = ''
+        eof = False
+        m = None
+        while m is None:
+            chunk = fp.read(JobStream.CHUNK_SIZE)
+            if not chunk:
+                raise JobInvalid("'" + self._path + "' has no 'dispatch' array.")
+            buffer += chunk
+            m = JobStream._reDispatchArray.search(buffer)
+        pos = m.end()
+        while True:
+            pos = JobStream._reSeparator.match(buffer, pos).end()
+            if pos < len(buffer) and buffer[pos] == ']':
+                return
+            try:
+                j, pos = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError as e:
+                if eof:
+                    raise JobInvalid("'" + self._path + "' is invalid: " + str(e))
+                # Object incomplete - drop the consumed part of the buffer and read further
+                chunk = fp.read(JobStream.CHUNK_SIZE)
+                eof = not chunk
+                buffer = buffer[pos:] + chunk
+                pos = 0
+                continue
+            yield j
+
+
+class JobInvalid(Exception):
+    pass
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+import base64
+import json
+import logging
+import os
+
+class SessionStore:
+    # Encrypted local store of a DKB session (cookies and account snapshot) for resuming it in a later run.
+    # The key is derived from login name and PIN, so the file is only readable with the credentials.
+    ITERATIONS = 200000
+    SALT_SIZE = 16
+
+    def __init__(self, path, userid, pin):
+        self._logger = logging.getLogger(self.__class__.__name__)
+        self._path = path
+        self._secret = (userid + '\0' + pin).encode('utf-8')
+        self._salt = None
+        self._fernet = None
+
+    def load(self):
+        # Returns the stored state, None if there is none or it can not be decrypted with the credentials
+        from cryptography.fernet import InvalidToken
+        try:
+            with open(self._path, 'rb') as fp:
+                data = fp.read()
+        except FileNotFoundError:
+            return None
+        try:
+            fernet = self._getFernet(data[:SessionStore.SALT_SIZE])
+            return json.loads(fernet.decrypt(data[SessionStore.SALT_SIZE:]).decode('utf-8'))
+        except (InvalidToken, ValueError) as e:
+            self._logger.warning("WARNING: Stored session not readable (" + e.__class__.__name__ + "), ignored.")
+            return None
+
+    def save(self, state):
+        if self._fernet is None:
+            self._getFernet(os.urandom(SessionStore.SALT_SIZE))
+        data = self._salt + self._fernet.encrypt(json.dumps(state).encode('utf-8'))
+        tmp = self._path + '.tmp'
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'wb') as fp:
+            fp.write(data)
+        os.replace(tmp, self._path)
+
+    def delete(self):
+        try:
+            os.remove(self._path)
+        except FileNotFoundError:
+            pass
+
+    def _getFernet(self, salt):
+        # Key derivation is expensive - derive once per salt
+        if self._fernet is None or salt != self._salt:
+            from cryptography.fernet import Fernet
+            from cryptography.hazmat.primitives import hashes
+            from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+            kdf = PBKDF2HMAC(algorithm=hashes.SHA256(), length=32, salt=salt, iterations=SessionStore.ITERATIONS)
+            self._fernet = Fernet(base64.urlsafe_b64encode(kdf.derive(self._secret)))
+            self._salt = salt
+        return self._fernet
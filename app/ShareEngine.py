@@ -0,0 +1,27 @@
+#!/usr/bin/env python3
+
+class ShareEngine:
+    # Batch calculation of dispatch job shares on NumPy arrays. NumPy is imported on first use.
+
+    @staticmethod
+    def shareValues(income, shares):
+        # Split 'income' (cents) by percentage 'shares' into cents with largest remainder rounding:
+        # every value is rounded down, the missing cents are handed out to the largest remainders
+        # (first job wins on ties), so the values sum up exactly to income * sum(shares) / 100, rounded down.
+        import numpy as np
+        shares = np.asarray(shares)
+        if shares.size == 0:
+            return np.zeros(0, dtype=np.int64)
+        if np.issubdtype(shares.dtype, np.integer):
+            values, remainders = np.divmod(shares.astype(np.int64) * income, 100)
+            missing = int(remainders.sum() // 100)
+        else:
+            exact = shares.astype(np.float64) * income / 100
+            values = np.floor(exact).astype(np.int64)
+            remainders = exact - values
+            missing = int(np.floor(exact.sum() + 1e-6)) - int(values.sum())
+        if missing > 0:
+            # Stable sort keeps job order among equal remainders
+            order = np.argsort(-remainders, kind='stable')
+            values[order[:missing]] += 1
+        return values
@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+import json
+import logging
+import os
+import re
+import socket
+import sys
+
+import config
+
+# Approval and TAN providers for 'DispatchIncome'. All providers have the same interface:
+#   confirm(text): show the job review 'text', returns True if the run is approved
+#   decide(transaction): returns (commit, tan) for a prepared transaction (dict with 'name', 'source',
+#     'target', 'amount' and 'tan' if a TAN is needed), raises KeyboardInterrupt to abort all
+#     remaining transactions
+#   interactive: True, if an operator answers at the terminal
+#   close()
+
+_reTan = re.compile(r'[0-9]{6}$')
+
+def _describe(transaction):
+    return "Transaction '" + transaction['name'] + "': " + transaction['source'] + " => " + transaction['target'] + " (" + transaction['amount'] + " EUR)"
+
+
+class TerminalTanProvider:
+    # Operator at the terminal: TANs are typed in, transactions without TAN confirmed with [y]
+    interactive = True
+
+    def __init__(self):
+        pass
+
+    def confirm(self, text):
+        import readchar
+        print(text + "\nType [y] to initiate transactions...")
+        return readchar.readchar().lower() == 'y'
+
+    def decide(self, transaction):
+        print(_describe(transaction))
+        if 'tan' in transaction:
+            while(True):
+                tan = input("TAN: ")
+                if _reTan.match(tan):
+                    return True, tan
+        import readchar
+        print("Type [y] to commit transaction...")
+        k = readchar.readchar()
+        return k.lower() == 'y', None
+
+    def close(self):
+        pass
+
+
+class TanListProvider:
+    # Pre-supplied TANs, one per line in c['TAN_LIST_FILE']. Used TANs are removed from the file.
+    # The job file is the approval: the review and transactions without TAN are confirmed.
+    interactive = False
+
+    def __init__(self):
+        self._logger = logging.getLogger(self.__class__.__name__)
+        self._path = config.c['TAN_LIST_FILE']
+        with open(self._path, 'r', encoding='utf-8') as fp:
+            self._tans = [ line.strip() for line in fp if line.strip() ]
+
+    def confirm(self, text):
+        print(text)
+        self._logger.info("Review confirmed by TAN list '" + self._path + "'.")
+        return True
+
+    def decide(self, transaction):
+        if 'tan' not in transaction:
+            return True, None
+        if not self._tans:
+            self._logger.error("ERROR: TAN list '" + self._path + "' exhausted, " + _describe(transaction) + " not committed.")
+            return False, None
+        tan = self._tans.pop(0)
+        # Never use a TAN twice - persist the remaining list before the TAN is submitted
+        tmp = self._path + '.tmp'
+        with open(tmp, 'w', encoding='utf-8') as fp:
+            fp.write(''.join(t + '\n' for t in self._tans))
+        os.replace(tmp, self._path)
+        if not _reTan.match(tan):
+            self._logger.error("ERROR: Invalid TAN in list '" + self._path + "', " + _describe(transaction) + " not committed.")
+            return False, None
+        return True, tan
+
+    def close(self):
+        pass
+
+
+class StdinTanProvider:
+    # Answers piped to stdin, one line per question: 'y' to confirm the review, a TAN or y/n per
+    # transaction. Questions are written to stderr. End of input aborts the remaining transactions.
+    interactive = False
+
+    def __init__(self):
+        self._logger = logging.getLogger(self.__class__.__name__)
+
+    def confirm(self, text):
+        print(text)
+        return self._readLine("Type [y] to initiate transactions...").lower() == 'y'
+
+    def decide(self, transaction):
+        if 'tan' in transaction:
+            tan = self._readLine(_describe(transaction) + " - TAN:")
+            if not _reTan.match(tan):
+                self._logger.error("ERROR: Invalid TAN, transaction not committed.")
+                return False, None
+            return True, tan
+        return self._readLine(_describe(transaction) + " - commit [y]:").lower() == 'y', None
+
+    def close(self):
+        pass
+
+    def _readLine(self, question):
+        sys.stderr.write(question + "\n")
+        sys.stderr.flush()
+        line = sys.stdin.readline()
+        if not line:
+            self._logger.info("End of input.")
+            raise KeyboardInterrupt()
+        return line.strip()
+
+
+class SocketTanProvider:
+    # Local unix socket c['TAN_SOCKET']: every question is sent to the connected client as JSON line,
+    # { "review": text } or the transaction, the client answers with one line: 'y'/'n' or the TAN.
+    # Without an answer within c['TAN_TIMEOUT'] seconds, the transaction is not committed.
+    interactive = False
+
+    def __init__(self):
+        self._logger = logging.getLogger(self.__class__.__name__)
+        self._path = config.c['TAN_SOCKET']
+        if os.path.exists(self._path):
+            os.remove(self._path)
+        self._server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._server.bind(self._path)
+        os.chmod(self._path, 0o600)
+        self._server.listen(1)
+        self._server.settimeout(config.c['TAN_TIMEOUT'])
+        self._conn = None
+        self._reader = None
+        self._logger.info("Waiting for approvals on socket '" + self._path + "'.")
+
+    def confirm(self, text):
+        print(text)
+        answer = self._ask({ 'review': text })
+        return answer is not None and answer.lower() == 'y'
+
+    def decide(self, transaction):
+        answer = self._ask(transaction)
+        if answer is None:
+            self._logger.error("ERROR: No answer on socket, " + _describe(transaction) + " not committed.")
+            return False, None
+        if 'tan' in transaction:
+            if not _reTan.match(answer):
+                self._logger.error("ERROR: Invalid TAN, transaction not committed.")
+                return False, None
+            return True, answer
+        return answer.lower() == 'y', None
+
+    def close(self):
+        self._disconnect()
+        self._server.close()
+        os.remove(self._path)
+
+    def _ask(self, question):
+        # Send 'question' and read the answer line, a broken connection is replaced once
+        for attempt in range(2):
+            try:
+                if self._conn is None:
+                    self._conn, address = self._server.accept()
+                    self._conn.settimeout(config.c['TAN_TIMEOUT'])
+                    self._reader = self._conn.makefile('r', encoding='utf-8')
+                self._conn.sendall((json.dumps(question) + '\n').encode('utf-8'))
+                line = self._reader.readline()
+                if line:
+                    return line.strip()
+            except socket.timeout:
+                return None
+            except OSError:
+                pass
+            self._disconnect()
+        return None
+
+    def _disconnect(self):
+        if self._conn is not None:
+            self._reader.close()
+            self._conn.close()
+            self._conn = None
+            self._reader = None
+
+
+class AutoApprovePolicy:
+    # Commits transactions without TAN (checking -> creditcard, creditcard -> checking) without asking 'provider'
+    def __init__(self, provider):
+        self._logger = logging.getLogger(self.__class__.__name__)
+        self._provider = provider
+        self.interactive = provider.interactive
+
+    def confirm(self, text):
+        return self._provider.confirm(text)
+
+    def decide(self, transaction):
+        if 'tan' not in transaction:
+            self._logger.info("Auto-approved: " + _describe(transaction))
+            return True, None
+        return self._provider.decide(transaction)
+
+    def close(self):
+        self._provider.close()
+
+
+# Providers, selected by config 'TAN_PROVIDER'
+PROVIDERS = {
+    'terminal': TerminalTanProvider,
+    'list': TanListProvider,
+    'stdin': StdinTanProvider,
+    'socket': SocketTanProvider
+}
+
+def createTanProvider():
+    provider = PROVIDERS[config.c['TAN_PROVIDER']]()
+    if config.c['AUTO_APPROVE_NO_TAN']:
+        provider = AutoApprovePolicy(provider)
+    return provider
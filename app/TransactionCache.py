@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+import datetime
+import hashlib
+import json
+import logging
+import os
+import re
+
+import config
+from Amount import Amount
+
+class TransactionCache:
+    # Local cache of checking account transactions, one entry per account with a cursor: the booking date
+    # of the newest cached row and the ids of all rows booked on that day. The next fetch starts at the
+    # cursor date, rows already seen are skipped. The first fetch of an account covers the last
+    # c['TRANSACTION_HISTORY_DAYS'] days, older rows are dropped on save.
+    # Rows are dicts with 'id', 'date', 'valueDate' (ISO dates), 'text', 'party', 'purpose', 'account' and
+    # 'amount' (cents), newest first.
+
+    def __init__(self, path):
+        self._logger = logging.getLogger(self.__class__.__name__)
+        self._path = path
+        self._accounts = self._load()
+        # Rows added since the last commit per account, identical rows per id digest within the current fetch
+        self._new = {}
+        self._occurrences = {}
+
+    def since(self, account):
+        # First booking date to fetch for 'account'
+        entry = self._accounts.get(account)
+        if entry and entry['cursor']:
+            return datetime.date.fromisoformat(entry['cursor'])
+        return datetime.date.today() - datetime.timedelta(days=config.c['TRANSACTION_HISTORY_DAYS'])
+
+    def add(self, account, transaction):
+        # Add a fetched 'DkbTransaction' of 'account'. Returns False, if the row is already cached.
+        # Rows have to be added in export order (newest first).
+        entry = self._accounts.setdefault(account, { 'cursor': None, 'seen': [], 'income': None, 'rows': [] })
+        row = {
+            'date': transaction.date.isoformat(),
+            'valueDate': transaction.valueDate.isoformat() if transaction.valueDate else None,
+            'text': transaction.text,
+            'party': transaction.party,
+            'purpose': transaction.purpose,
+            'account': transaction.account,
+            'amount': transaction.amount.cents
+        }
+        digest = hashlib.sha256(json.dumps([ account, row ]).encode('utf-8')).hexdigest()[:16]
+        occurrence = self._occurrences.get(digest, 0)
+        self._occurrences[digest] = occurrence + 1
+        row['id'] = digest + '-' + str(occurrence)
+        if entry['cursor'] and (row['date'] < entry['cursor'] or (row['date'] == entry['cursor'] and row['id'] in entry['seen'])):
+            return False
+        self._new.setdefault(account, []).append(row)
+        return True
+
+    def commit(self, account):
+        # Merge the rows added since the last commit of 'account' and advance its cursor. Returns the number of new rows.
+        self._occurrences = {}
+        new = self._new.pop(account, None)
+        if not new:
+            return 0
+        entry = self._accounts[account]
+        entry['rows'] = new + entry['rows']
+        cursor = max(row['date'] for row in new)
+        if cursor != entry['cursor']:
+            entry['seen'] = []
+            entry['cursor'] = cursor
+        entry['seen'] += [ row['id'] for row in new if row['date'] == cursor ]
+        entry['rows'].sort(key=lambda row: row['date'], reverse=True)
+        return len(new)
+
+    def rows(self, account):
+        entry = self._accounts.get(account)
+        return entry['rows'] if entry else []
+
+    def income(self, account, pattern):
+        # Newest credit of 'account' matching 'pattern' in booking text, sender or purpose, which was not used as
+        # income yet. Returns the row, None if there is no new one.
+        entry = self._accounts.get(account)
+        if not entry:
+            return None
+        rePattern = re.compile(pattern, re.I)
+        for row in entry['rows']:
+            if row['amount'] > 0 and (rePattern.search(row['text']) or rePattern.search(row['party']) or rePattern.search(row['purpose'])):
+                return row if row['id'] != entry['income'] else None
+        return None
+
+    def useIncome(self, account, row):
+        # Mark income 'row' as dispatched, it is not returned by 'income' anymore
+        self._accounts[account]['income'] = row['id']
+
+    @staticmethod
+    def amount(row):
+        return Amount.fromCents(row['amount'])
+
+    def save(self):
+        oldest = (datetime.date.today() - datetime.timedelta(days=config.c['TRANSACTION_HISTORY_DAYS'])).isoformat()
+        for entry in self._accounts.values():
+            entry['rows'] = [ row for row in entry['rows'] if row['date'] >= oldest or row['id'] == entry['income'] ]
+        # Bank statements are private: owner only, replaced atomically
+        tmp = self._path + '.tmp'
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w', encoding='utf-8') as fp:
+            json.dump({ 'accounts': self._accounts }, fp)
+        os.replace(tmp, self._path)
+
+    def _load(self):
+        try:
+            with open(self._path, 'r', encoding='utf-8') as fp:
+                return json.load(fp)['accounts']
+        except FileNotFoundError:
+            return {}
+        except (ValueError, KeyError) as e:
+            self._logger.warning("WARNING: Transaction cache '" + self._path + "' unreadable (" + str(e) + "), fetching again.")
+            return {}
@@ -1,21 +1,75 @@
 import logging
 import sys
 
-logging.getLogger().setLevel(logging.DEBUG)
-handler = logging.StreamHandler(sys.stdout)
-handler.setLevel(logging.DEBUG)
-formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-handler.setFormatter(formatter)
-logging.getLogger().addHandler(handler)
-
-# Disable debug message for 'chardet' and 'urllib3'
-logging.getLogger('urllib3').setLevel(logging.WARNING)
-logging.getLogger('chardet').setLevel(logging.WARNING)
-#import http.client as http_client
-#http_client.HTTPConnection.debuglevel = 1
-#logging.getLogger('requests.packages.urllib3').setLevel(logging.DEBUG)
-#logging.getLogger('requests.packages.urllib3').propagate = True
+def setupLogging(level=logging.DEBUG):
+    # Log to stdout. Called by the entry points, so importing the modules has no side effects.
+    root = logging.getLogger()
+    root.setLevel(level)
+    if not root.handlers:
+        handler = logging.StreamHandler(sys.stdout)
+        handler.setLevel(logging.DEBUG)
+        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+        handler.setFormatter(formatter)
+        root.addHandler(handler)
+    # Disable debug message for 'chardet' and 'urllib3'
+    logging.getLogger('urllib3').setLevel(logging.WARNING)
+    logging.getLogger('chardet').setLevel(logging.WARNING)
+    #import http.client as http_client
+    #http_client.HTTPConnection.debuglevel = 1
+    #logging.getLogger('requests.packages.urllib3').setLevel(logging.DEBUG)
+    #logging.getLogger('requests.packages.urllib3').propagate = True
 
 c = {}
 c['DISPATCH_CONFIG_FILE'] = 'job.json'
 c['DRYRUN'] = False
+# Maximum age in seconds of the cached account snapshot, before it is fetched again from the server.
+# Successful transactions are booked on the local snapshot in between. 0 disables the cache.
+c['ACCOUNTS_MAX_AGE'] = 300
+# Transport engine: 'robobrowser' or 'http' (pooled keep-alive session, responses parsed on demand only)
+c['ENGINE'] = 'robobrowser'
+c['HTTP_POOL_SIZE'] = 4
+c['HTTP_TIMEOUT'] = 30
+# Bounded-memory session: the 'robobrowser' engine keeps only the current page instead of the whole navigation
+# history, so memory stays flat on long runs. The 'http' engine always keeps the current page only.
+c['BOUNDED_SESSION'] = True
+# Pipelined dispatch: review all jobs at once, then enter TANs while the next transaction is prepared in the session
+# of its source account (see c['ASYNC_SESSIONS'])
+c['PIPELINE'] = False
+# Stream jobs: read, validate and remit jobs one by one (always enabled for '.jsonl' job files)
+c['STREAM_JOBS'] = False
+# Session resume: path of the encrypted session file (cookies and account snapshot), None disables it.
+# With a session file, the server session is kept open at the end of a run instead of logging out.
+c['SESSION_STORE'] = None
+# Asyncio client ('AsyncDkb'): maximum number of parallel sessions of one login, each serving its own source accounts
+c['ASYNC_SESSIONS'] = 4
+# Batch dispatch ('dispatchBatch'): manifest of tenants (login and job file) and number of parallel worker processes
+c['BATCH_MANIFEST'] = 'batch.json'
+c['BATCH_WORKERS'] = 4
+# Instrumentation of Dkb steps: None (disabled), 'memory' (in-memory histogram), 'jsonl' (trace of every step)
+# or 'prometheus' (text format, written at logout). 'jsonl' and 'prometheus' write to METRICS_FILE.
+c['METRICS_SINK'] = None
+c['METRICS_FILE'] = 'dkb-metrics.prom'
+# Journal of job stages in '<DISPATCH_CONFIG_FILE>.journal': jobs approved in an aborted run are skipped by the next run
+c['JOURNAL'] = True
+# Maximum age in seconds of a journal to resume from, older ones are set aside
+c['JOURNAL_MAX_AGE'] = 7 * 24 * 3600
+# Plan job lists on the account snapshot after login: jobs are reordered to cover as many as possible, uncovered ones
+# are rejected before any transaction. Unsupported jobs are always rejected.
+c['PLAN_JOBS'] = True
+# Approval of reviews and transactions: 'terminal' (operator), 'list' (TANs from TAN_LIST_FILE),
+# 'stdin' (answers piped to stdin, one per line) or 'socket' (client on the unix socket TAN_SOCKET)
+c['TAN_PROVIDER'] = 'terminal'
+c['TAN_LIST_FILE'] = 'tan.txt'
+c['TAN_SOCKET'] = 'dispatch.sock'
+c['TAN_TIMEOUT'] = 300
+# Commit transactions without TAN (checking -> creditcard, creditcard -> checking) without asking
+c['AUTO_APPROVE_NO_TAN'] = False
+# Income detection: with relative shares, the shared income is taken from the newest salary credit on INCOME_ACCOUNT
+# (None: first checking account), found by INCOME_PATTERN in booking text, sender or purpose. Transactions are cached
+# in TRANSACTION_CACHE, later runs only fetch the rows booked since the newest cached one.
+c['DETECT_INCOME'] = False
+c['INCOME_ACCOUNT'] = None
+c['INCOME_PATTERN'] = r'Gehalt|Lohn|Bezüge'
+c['TRANSACTION_CACHE'] = 'transactions.json'
+# Days of transactions fetched on the first run and kept in the cache
+c['TRANSACTION_HISTORY_DAYS'] = 90
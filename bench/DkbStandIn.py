@@ -0,0 +1,461 @@
+#!/usr/bin/env python3
+import datetime
+import html
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+# Local stand-in for the DKB banking website. Serves the subset of pages 'Dkb' drives
+# (login, financial status, remittance steps, review and approval, transaction search and
+# CSV export) from an in-memory
+# account model, so the hot path can be measured and regression-tested offline.
+class DkbStandIn:
+    SERVICE_LOGIN = '/-'
+    SERVICE_FINANCIAL_STATUS = '/DkbTransactionBanking/content/banking/financialstatus/FinancialComposite/FinancialStatus.xhtml'
+    SERVICE_TRANSFER = '/DkbTransactionBanking/content/SepaTransfer/SepaTransfer.xhtml'
+    SERVICE_LOGOUT = '/DkbTransactionBanking/banner.xhtml'
+    SERVICE_TRANSACTIONS = '/banking/finanzstatus/kontoumsaetze'
+
+    ACCTYPE_LABELS = {
+        'CHECKING': 'Girokonto',
+        'CREDITCARD': 'Kreditkarte'
+    }
+
+    KIND_CHECKING_CHECKING = 'CHECKING_CHECKING'
+    KIND_CHECKING_CREDITCARD = 'CHECKING_CREDITCARD'
+    KIND_CREDITCARD_CHECKING = 'CREDITCARD_CHECKING'
+
+    def __init__(self, filler=200, host='127.0.0.1', port=0, latency=0.0):
+        # 'filler' adds navigation entries to every page to approximate the weight of the real website.
+        # 'latency' delays every response by this number of seconds, like the round trip to the real website.
+        self._filler = self._renderFiller(filler)
+        self.latency = latency
+        self._users = {}
+        self._sessions = {}
+        self._lock = threading.Lock()
+        self.failTans = set()
+        self.resetCounters()
+        class Handler(DkbStandInHandler):
+            standIn = self
+        self._server = ThreadingHTTPServer((host, port), Handler)
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return 'http://' + host + ':' + str(port)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._thread:
+            self._server.shutdown()
+            self._thread = None
+        self._server.server_close()
+
+    def expireSessions(self):
+        with self._lock:
+            self._sessions.clear()
+
+    def addUser(self, userid, pin, groups):
+        # groups: list of account groups, each a list of { 'type': 'CHECKING'|'CREDITCARD', 'number': str, 'balance': cents }
+        # An optional 'label' overrides the account type text shown on the financial status page.
+        self._users[userid] = {
+            'pin': pin,
+            'groups': [ [ dict(account) for account in group ] for group in groups ]
+        }
+
+    def addTransaction(self, userid, number, date, amount, party, purpose, text=None):
+        # Book a transaction of 'amount' cents on 'date' (datetime.date) to the statement of checking account 'number'
+        account = self._findAccount(self._users[userid], number)
+        with self._lock:
+            account.setdefault('transactions', []).append({
+                'date': date,
+                'text': text if text else ('Gutschrift' if amount > 0 else 'Lastschrift'),
+                'party': party,
+                'purpose': purpose,
+                'amount': amount
+            })
+
+    def getBalance(self, userid, number):
+        return self._findAccount(self._users[userid], number)['balance']
+
+    def setBalance(self, userid, number, balance):
+        self._findAccount(self._users[userid], number)['balance'] = balance
+
+    def resetCounters(self):
+        with self._lock:
+            self.requests = 0
+            self.bytesSent = 0
+            self.transfers = 0
+
+    def count(self, size):
+        with self._lock:
+            self.requests += 1
+            self.bytesSent += size
+
+    def financialStatusPage(self, userid):
+        # Render the financial status page of 'userid' without a running server (parser benchmarks and fixtures)
+        return self._renderFinancialStatus({ 'user': userid })
+
+    def reviewPage(self, userid, source, target, amount):
+        # Render the review page of a transaction without a running server (parser benchmarks and fixtures)
+        user = self._users[userid]
+        source = self._findAccount(user, source)
+        try:
+            target = self._findAccount(user, target)
+        except KeyError:
+            target = { 'type': 'CHECKING', 'number': target, 'balance': 0, 'remote': True }
+        if source['type'] == 'CREDITCARD':
+            kind = DkbStandIn.KIND_CREDITCARD_CHECKING
+        elif target['type'] == 'CREDITCARD':
+            kind = DkbStandIn.KIND_CHECKING_CREDITCARD
+        else:
+            kind = DkbStandIn.KIND_CHECKING_CHECKING
+        return self._renderReview({ 'transfer': { 'source': source, 'target': target, 'amount': amount, 'kind': kind } })
+
+    ### Request dispatching
+
+    def handle(self, method, path, query, form, sessionId):
+        session = self._sessions.get(sessionId) if sessionId else None
+        if path == DkbStandIn.SERVICE_LOGIN:
+            if method == 'POST':
+                return self._login(form)
+            sessionId = uuid.uuid4().hex
+            self._sessions[sessionId] = { 'user': None }
+            return 200, self._renderLogin(), None, sessionId
+        if session is None or session['user'] is None:
+            return 302, None, DkbStandIn.SERVICE_LOGIN, None
+        if path == DkbStandIn.SERVICE_FINANCIAL_STATUS:
+            if query.get('$event') == 'paymentTransaction':
+                return self._startTransfer(session, query)
+            return 200, self._renderFinancialStatus(session), None, None
+        if path == DkbStandIn.SERVICE_TRANSFER and method == 'POST':
+            event = form.get('$event')
+            if event == 'creditor':
+                return self._selectCreditor(session, form)
+            if event == 'amount':
+                return self._enterAmount(session, form)
+            if event == 'approve':
+                return self._approve(session, form)
+        if path == DkbStandIn.SERVICE_TRANSACTIONS:
+            if method == 'POST' and form.get('$event') == 'search':
+                return self._searchTransactions(session, form)
+            if query.get('$event') == 'csvExport':
+                return self._exportTransactions(session)
+            return 200, self._renderTransactionSearch(session), None, None
+        if path == DkbStandIn.SERVICE_LOGOUT and query.get('$event') == 'logout':
+            del self._sessions[sessionId]
+            return 200, self._renderLogin(), None, None
+        return 404, self._renderPage("<h1>Not found</h1>"), None, None
+
+    def _login(self, form):
+        user = self._users.get(form.get('j_username'))
+        if user is None or user['pin'] != form.get('j_password'):
+            return 200, self._renderLogin(error="Login failed."), None, None
+        sessionId = uuid.uuid4().hex
+        self._sessions[sessionId] = { 'user': form.get('j_username') }
+        return 302, None, DkbStandIn.SERVICE_FINANCIAL_STATUS, sessionId
+
+    def _startTransfer(self, session, query):
+        user = self._users[session['user']]
+        try:
+            source = user['groups'][int(query.get('group'))][int(query.get('row'))]
+        except (TypeError, ValueError, IndexError):
+            return 404, self._renderPage("<h1>Not found</h1>"), None, None
+        session['transfer'] = { 'source': source }
+        if source['type'] == 'CREDITCARD':
+            # Creditcards are bound to the first checking account, skip creditor selection.
+            session['transfer']['target'] = self._checkingAccounts(user)[0]
+            session['transfer']['kind'] = DkbStandIn.KIND_CREDITCARD_CHECKING
+            return 200, self._renderAmountForm(session, False), None, None
+        return 200, self._renderCreditorForm(session), None, None
+
+    def _selectCreditor(self, session, form):
+        user = self._users[session['user']]
+        transfer = session.get('transfer')
+        if not transfer:
+            return 200, self._renderError("No transfer in progress."), None, None
+        if form.get('creditorAccountType') == '2':
+            own = self._ownCreditorAccounts(user, transfer['source'])
+            target = own[int(form.get('slOwnCreditorAccounts', '0'))]
+            transfer['target'] = target
+            transfer['creditorName'] = None
+            if target['type'] == 'CREDITCARD':
+                transfer['kind'] = DkbStandIn.KIND_CHECKING_CREDITCARD
+                return 200, self._renderAmountForm(session, False), None, None
+        else:
+            number = form.get('creditorAccountNo', '')
+            if not re.match(r'[A-Z]{2}\d{20}$', number) or not form.get('creditorName'):
+                return 200, self._renderError("Invalid creditor."), None, None
+            transfer['target'] = { 'type': 'CHECKING', 'number': number, 'balance': 0, 'remote': True }
+            transfer['creditorName'] = form.get('creditorName')
+        transfer['kind'] = DkbStandIn.KIND_CHECKING_CHECKING
+        return 200, self._renderAmountForm(session, True), None, None
+
+    def _enterAmount(self, session, form):
+        transfer = session.get('transfer')
+        if not transfer or 'target' not in transfer:
+            return 200, self._renderError("No transfer in progress."), None, None
+        amount = self._parseAmount(form.get('amountToTransfer', ''))
+        if amount is None or amount <= 0:
+            return 200, self._renderError("Invalid amount."), None, None
+        transfer['amount'] = amount
+        transfer['purpose'] = form.get('paymentPurposeLine')
+        return 200, self._renderReview(session), None, None
+
+    def _approve(self, session, form):
+        transfer = session.pop('transfer', None)
+        if not transfer or 'amount' not in transfer:
+            return 200, self._renderError("No transfer in progress."), None, None
+        if transfer['kind'] == DkbStandIn.KIND_CHECKING_CHECKING:
+            tan = form.get('tan', '')
+            if not re.match(r'\d{6}$', tan) or tan in self.failTans:
+                return 200, self._renderError("TAN invalid."), None, None
+        with self._lock:
+            if transfer['source']['balance'] < transfer['amount']:
+                return 200, self._renderError("Balance not sufficient."), None, None
+            transfer['source']['balance'] -= transfer['amount']
+            if not transfer['target'].get('remote'):
+                transfer['target']['balance'] += transfer['amount']
+            self.transfers += 1
+        body = '<div class="successBox"><ul><li>Der Auftrag wurde ausgef&uuml;hrt (' + self._formatAmount(transfer['amount']) + ' EUR).</li></ul></div>'
+        return 200, self._renderPage(body, True), None, None
+
+    def _searchTransactions(self, session, form):
+        checking = self._checkingAccounts(self._users[session['user']])
+        try:
+            account = checking[int(form.get('slAllAccounts', '0'))]
+            since = datetime.datetime.strptime(form.get('transactionDate', ''), '%d.%m.%Y').date()
+            until = datetime.datetime.strptime(form.get('toTransactionDate', ''), '%d.%m.%Y').date()
+        except (ValueError, IndexError):
+            return 200, self._renderError("Invalid search."), None, None
+        session['search'] = { 'account': account, 'since': since, 'until': until }
+        return 200, self._renderTransactionSearch(session), None, None
+
+    def _exportTransactions(self, session):
+        search = session.get('search')
+        if not search:
+            return 200, self._renderError("No search."), None, None
+        account = search['account']
+        with self._lock:
+            rows = [ t for t in account.get('transactions', []) if search['since'] <= t['date'] <= search['until'] ]
+        # Newest first, like the real export
+        rows.sort(key=lambda t: t['date'], reverse=True)
+        quote = lambda values: ';'.join('"' + str(v).replace('"', '""') + '"' for v in values) + ';'
+        lines = [
+            quote([ 'Kontonummer:', self._accountLabel(account) ]),
+            '',
+            quote([ 'Von:', search['since'].strftime('%d.%m.%Y') ]),
+            quote([ 'Bis:', search['until'].strftime('%d.%m.%Y') ]),
+            quote([ 'Kontostand vom ' + search['until'].strftime('%d.%m.%Y') + ':', self._formatAmount(account['balance']) + ' EUR' ]),
+            '',
+            quote([ 'Buchungstag', 'Wertstellung', 'Buchungstext', 'Auftraggeber / Begünstigter', 'Verwendungszweck', 'Kontonummer', 'BLZ', 'Betrag (EUR)', 'Gläubiger-ID', 'Mandatsreferenz', 'Kundenreferenz' ])
+        ]
+        for t in rows:
+            date = t['date'].strftime('%d.%m.%Y')
+            lines.append(quote([ date, date, t['text'], t['party'], t['purpose'], '', '', self._formatAmount(t['amount']), '', '', '' ]))
+        return 200, ('\r\n'.join(lines) + '\r\n').encode('iso-8859-1'), None, None
+
+    ### Account model helpers
+
+    def _findAccount(self, user, number):
+        for group in user['groups']:
+            for account in group:
+                if account['number'] == number:
+                    return account
+        raise KeyError(number)
+
+    def _checkingAccounts(self, user):
+        return [ a for g in user['groups'] for a in g if a['type'] == 'CHECKING' ]
+
+    def _ownCreditorAccounts(self, user, source):
+        return [ a for g in user['groups'] for a in g if a is not source ]
+
+    @staticmethod
+    def _parseAmount(value):
+        value = value.strip()
+        m = re.match(r'^(-?)([\d\.]*\d)(?:[,\.](\d{2}))?$', value)
+        if not m:
+            return None
+        cents = int(re.sub(r'\.', '', m.group(2))) * 100 + int(m.group(3) or 0)
+        return -cents if m.group(1) else cents
+
+    @staticmethod
+    def _formatAmount(cents):
+        sign = '-' if cents < 0 else ''
+        euros, cents = divmod(abs(cents), 100)
+        return sign + '{:,}'.format(euros).replace(',', '.') + ',' + '{:02d}'.format(cents)
+
+    @staticmethod
+    def _formatNumber(account):
+        number = account['number']
+        if account['type'] == 'CHECKING':
+            number = ' '.join(number[i:i + 4] for i in range(0, len(number), 4))
+        return number
+
+    def _accountLabel(self, account):
+        if account.get('remote'):
+            return self._formatNumber(account)
+        return self._formatNumber(account) + ' / ' + account.get('label', DkbStandIn.ACCTYPE_LABELS[account['type']])
+
+    ### Page rendering
+
+    @staticmethod
+    def _renderFiller(entries):
+        items = ''.join('<li class="navItem"><a href="/DkbTransactionBanking/content/nav/' + str(i) + '.xhtml" title="Navigation entry ' + str(i) + '">Navigation entry ' + str(i) + '</a></li>' for i in range(entries))
+        return '<ul id="navigation">' + items + '</ul>'
+
+    def _renderPage(self, body, loggedIn=False, main=''):
+        # The main form is always the third form of the page, as 'Dkb' expects 'get_forms()[2]'.
+        logout = '<a id="logout" href="' + DkbStandIn.SERVICE_LOGOUT + '?$event=logout">Abmelden</a>' if loggedIn else ''
+        return ('<!DOCTYPE html><html><head><meta charset="utf-8"><title>DKB Banking</title></head><body>'
+                '<div id="header">' + logout +
+                '<form id="search" action="/search" method="get"><input type="text" name="q"></form>'
+                '<form id="quicknav" action="/quicknav" method="get"><select name="target"><option value="0">Finanzstatus</option></select></form>'
+                '</div>' + self._filler + '<div id="content">' + main + body + '</div></body></html>')
+
+    def _renderLogin(self, error=None):
+        errorBlock = '<div class="errorMessage"><ul><li>' + error + '</li></ul></div>' if error else ''
+        fields = ''.join('<input type="hidden" name="' + n + '" value="">' for n in [ 'jsEnabled', 'browserName', 'browserVersion', 'screenWidth', 'screenHeight', 'osName' ])
+        form = ('<form id="login" action="' + DkbStandIn.SERVICE_LOGIN + '" method="post">'
+                '<input type="text" name="j_username"><input type="password" name="j_password">' + fields +
+                '<input type="submit" name="buttonlogin" value="Anmelden"></form>')
+        return self._renderPage(errorBlock, main=form)
+
+    def _renderFinancialStatus(self, session):
+        user = self._users[session['user']]
+        rows = []
+        for g, group in enumerate(user['groups']):
+            for r, account in enumerate(group):
+                rows.append('<tr id="gruppe-' + str(g) + '_' + str(r) + '" class="mainRow">'
+                            '<td><div class="forceWrap">' + account.get('label', DkbStandIn.ACCTYPE_LABELS[account['type']]) + '</div>'
+                            '<div class="iban">' + self._formatNumber(account) + '</div></td>'
+                            '<td class="amount"><span>' + self._formatAmount(account['balance']) + '</span>&nbsp;EUR</td>'
+                            '<td class="actions"><a tid="remittance" href="' + DkbStandIn.SERVICE_FINANCIAL_STATUS + '?$event=paymentTransaction&amp;row=' + str(r) + '&amp;group=' + str(g) + '">&Uuml;berweisung</a></td>'
+                            '</tr>')
+        body = '<table class="financialStatus"><tbody>' + ''.join(rows) + '</tbody></table>'
+        return self._renderPage(body, True)
+
+    def _renderCreditorForm(self, session):
+        user = self._users[session['user']]
+        source = session['transfer']['source']
+        options = ''.join('<option value="' + str(i) + '">' + html.escape(self._accountLabel(a)) + '</option>' for i, a in enumerate(self._ownCreditorAccounts(user, source)))
+        form = ('<form id="form1434775544_1" action="' + DkbStandIn.SERVICE_TRANSFER + '" method="post">'
+                '<input type="hidden" name="$event" value="creditor">'
+                # Template radio group, disabled - mirrors the duplicate 'creditorAccountType' fields of the real website.
+                '<div class="template"><input type="radio" name="creditorAccountType" value="1" disabled>'
+                '<input type="radio" name="creditorAccountType" value="2" disabled></div>'
+                '<input type="hidden" name="separator" value="">'
+                '<input type="radio" name="creditorAccountType" value="1" checked> Andere Bank'
+                '<input type="radio" name="creditorAccountType" value="2"> Eigenes Konto'
+                '<select name="slOwnCreditorAccounts">' + options + '</select>'
+                '<input type="text" name="creditorName"><input type="text" name="creditorAccountNo">'
+                '<input type="submit" name="next" value="Weiter"></form>')
+        return self._renderPage('', True, main=form)
+
+    def _renderAmountForm(self, session, withPurpose):
+        purpose = '<input type="text" name="paymentPurposeLine">' if withPurpose else ''
+        form = ('<form id="form1434775544_1" action="' + DkbStandIn.SERVICE_TRANSFER + '" method="post">'
+                '<input type="hidden" name="$event" value="amount">'
+                '<input type="text" name="amountToTransfer">' + purpose +
+                '<input type="submit" name="next" value="Weiter"></form>')
+        return self._renderPage('', True, main=form)
+
+    def _renderReview(self, session):
+        transfer = session['transfer']
+        source = html.escape(self._accountLabel(transfer['source']))
+        target = html.escape(self._accountLabel(transfer['target']))
+        amount = self._formatAmount(transfer['amount'])
+        tan = ''
+        if transfer['kind'] == DkbStandIn.KIND_CREDITCARD_CHECKING:
+            review = ('<fieldset>'
+                      '<p><span class="col35">Auftraggeber</span><span class="col65 floatRight"><strong>' + source + '</strong></span></p>'
+                      '<p><span class="col35">Empf&auml;nger</span><span class="col65 floatRight"><strong>' + target + '</strong></span></p>'
+                      '<p><span class="col35">Betrag</span><span class="col65 floatRight"><strong>' + amount + '</strong></span></p>'
+                      '</fieldset>')
+        elif transfer['kind'] == DkbStandIn.KIND_CHECKING_CREDITCARD:
+            review = ('<fieldset>'
+                      '<p><span id="outOrderingCustomerAccount">' + source + '</span></p>'
+                      '<p><span id="outOwnPayeeAccount">' + target + '</span></p>'
+                      '<p><span id="outAmountToTransfer">' + amount + '</span></p>'
+                      '</fieldset>')
+        else:
+            review = ('<fieldset>'
+                      '<p><span id="outOrderingCustomerAccount.accountNo">' + source + '</span></p>'
+                      '<p><span id="outCreditorAccountNo">' + target + '</span></p>'
+                      '<p><span id="outAmountToTransfer">' + amount + '</span></p>'
+                      '</fieldset>')
+            tan = '<input type="text" name="tan">'
+        form = ('<form id="form1434775544_1" action="' + DkbStandIn.SERVICE_TRANSFER + '" method="post">'
+                '<input type="hidden" name="$event" value="approve">' + review + tan +
+                '<input type="submit" name="confirm" value="Ausf&uuml;hren"></form>')
+        return self._renderPage('', True, main=form)
+
+    def _renderTransactionSearch(self, session):
+        checking = self._checkingAccounts(self._users[session['user']])
+        options = ''.join('<option value="' + str(i) + '">' + html.escape(self._accountLabel(a)) + '</option>' for i, a in enumerate(checking))
+        form = ('<form id="form1579108072_1" action="' + DkbStandIn.SERVICE_TRANSACTIONS + '" method="post">'
+                '<input type="hidden" name="$event" value="search">'
+                '<select name="slAllAccounts">' + options + '</select>'
+                '<input type="radio" name="searchPeriodRadio" value="0" checked> Zeitraum'
+                '<input type="radio" name="searchPeriodRadio" value="1"> Datum'
+                '<input type="text" name="transactionDate"><input type="text" name="toTransactionDate">'
+                '<input type="submit" name="search" value="Umsätze anzeigen"></form>')
+        return self._renderPage('', True, main=form)
+
+    def _renderError(self, message):
+        return self._renderPage('<div class="errorMessage"><ul><li>' + message + '</li></ul></div>', True)
+
+
+class DkbStandInHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    standIn = None
+
+    def do_GET(self):
+        self._dispatch('GET')
+
+    def do_POST(self):
+        self._dispatch('POST')
+
+    def log_message(self, format, *args):
+        pass
+
+    def _dispatch(self, method):
+        url = urlsplit(self.path)
+        query = { k: v[0] for k, v in parse_qs(url.query, keep_blank_values=True).items() }
+        form = {}
+        if method == 'POST':
+            length = int(self.headers.get('Content-Length', 0))
+            body = self.rfile.read(length).decode('utf-8')
+            # First value wins, as duplicate radio names are posted by some clients.
+            for k, v in parse_qs(body, keep_blank_values=True).items():
+                form[k] = v[0]
+        sessionId = None
+        m = re.search(r'JSESSIONID=([0-9a-f]+)', self.headers.get('Cookie', ''))
+        if m:
+            sessionId = m.group(1)
+        status, body, location, newSession = self.standIn.handle(method, url.path, query, form, sessionId)
+        if self.standIn.latency:
+            time.sleep(self.standIn.latency)
+        # Pages are rendered as str, file exports as bytes
+        export = isinstance(body, bytes)
+        payload = body if export else (body.encode('utf-8') if body else b'')
+        self.send_response(status)
+        if location:
+            self.send_header('Location', location)
+        if newSession:
+            self.send_header('Set-Cookie', 'JSESSIONID=' + newSession + '; Path=/')
+        self.send_header('Content-Type', 'text/csv; charset=ISO-8859-1' if export else 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+        self.standIn.count(len(payload))